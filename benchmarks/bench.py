@@ -0,0 +1,263 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from ugit import base
+from ugit import data
+from ugit import diff
+from ugit import remote
+from ugit.repository import Repository
+
+from . import generate
+
+BENCHMARKS: Dict[str, Callable[[str], Callable[[], None]]] = {}
+MODIFIED_FILES = 50
+LOG_MAX_COUNT = 100
+
+
+def benchmark(name: str):
+    def register(setup: Callable[[str], Callable[[], None]]):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _modify_files(worktree: str, count: int) -> List[str]:
+    paths = sorted(base.get_index_tree())[:count]
+
+    for path in paths:
+        with open(os.path.join(worktree, path), "ab") as f:
+            f.write(b"benchmark change\n")
+
+    return paths
+
+
+@benchmark("add")
+def bench_add(worktree: str) -> Callable[[], None]:
+    paths = _modify_files(worktree, MODIFIED_FILES)
+    return lambda: base.add(paths)
+
+
+@benchmark("commit")
+def bench_commit(worktree: str) -> Callable[[], None]:
+    base.add(_modify_files(worktree, MODIFIED_FILES))
+    return lambda: base.commit("benchmark commit")
+
+
+@benchmark("status")
+def bench_status(worktree: str) -> Callable[[], None]:
+    _modify_files(worktree, MODIFIED_FILES)
+
+    def status():
+        head = base.get_object_id("@")
+        head_tree = base.get_tree(base.get_commit(head).tree)
+        list(diff.iter_changed_files(head_tree, base.get_index_tree()))
+        list(diff.iter_changed_files(
+            base.get_index_tree(), base.get_working_tree()))
+
+    return status
+
+
+@benchmark("checkout")
+def bench_checkout(worktree: str) -> Callable[[], None]:
+    return lambda: base.checkout(generate.TOPIC_BRANCH)
+
+
+@benchmark("log")
+def bench_log(worktree: str) -> Callable[[], None]:
+    def log():
+        object_ids = base.iter_commits([base.get_object_id("@")])
+
+        for object_id in itertools.islice(object_ids, LOG_MAX_COUNT):
+            base.get_commit(object_id)
+
+    return log
+
+
+@benchmark("merge")
+def bench_merge(worktree: str) -> Callable[[], None]:
+    return lambda: base.merge(base.get_object_id(generate.TOPIC_BRANCH))
+
+
+def _init_empty_repository(path: str) -> Repository:
+    source = data.get_repository()
+    repository = Repository(path)
+    os.makedirs(repository.worktree)
+
+    with data.use_repository(repository):
+        base.init(source.get_config().get("objectStore", "loose"),
+                  object_format=source.object_format)
+
+    return repository
+
+
+@benchmark("fetch")
+def bench_fetch(worktree: str) -> Callable[[], None]:
+    clone = _init_empty_repository(
+        os.path.join(os.path.dirname(worktree), "clone"))
+
+    def fetch():
+        with data.use_repository(clone):
+            remote.fetch(worktree)
+
+    return fetch
+
+
+@benchmark("push")
+def bench_push(worktree: str) -> Callable[[], None]:
+    target = _init_empty_repository(
+        os.path.join(os.path.dirname(worktree), "target"))
+
+    return lambda: remote.push(target.worktree, os.path.join("refs", "heads", "master"))
+
+
+def run_benchmark(name: str, source: str, repeat: int) -> List[float]:
+    times = []
+
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            worktree = os.path.join(temp_dir, "repo")
+            shutil.copytree(source, worktree)
+
+            cwd = os.getcwd()
+            os.chdir(worktree)
+
+            try:
+                repository = Repository(worktree)
+
+                with data.use_repository(repository):
+                    operation = BENCHMARKS[name](worktree)
+
+                    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                        start = time.perf_counter()
+                        operation()
+                        times.append(time.perf_counter() - start)
+
+                repository.close()
+            finally:
+                os.chdir(cwd)
+
+    return times
+
+
+def run(args: argparse.Namespace):
+    names = args.benchmarks or list(BENCHMARKS)
+
+    for name in names:
+        assert name in BENCHMARKS, f"Unknown benchmark {name}"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = args.repo
+
+        if not source:
+            source = os.path.join(temp_dir, "source")
+            generate.generate_from_args(source, args)
+
+        results = {}
+
+        for name in names:
+            times = run_benchmark(name, source, args.repeat)
+            results[name] = {
+                "times": times,
+                "min": min(times),
+                "median": statistics.median(times),
+            }
+            print(f"{name:>10}: {results[name]['median'] * 1000:10.2f} ms",
+                  file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "params": {key: getattr(args, key) for key in
+                       ("files", "depth", "history", "branchiness", "blob_size",
+                        "changes", "object_store", "object_format", "seed", "repo")},
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def compare(args: argparse.Namespace):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    with open(args.current) as f:
+        current = json.load(f)
+
+    if baseline["meta"]["params"] != current["meta"]["params"]:
+        print("warning: runs used different repository parameters", file=sys.stderr)
+
+    regressions = []
+
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        old = baseline["results"][name][args.statistic]
+        new = result[args.statistic]
+        change = (new - old) / old if old else 0.0
+        flag = ""
+
+        if change > args.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif change < -args.threshold:
+            flag = "improvement"
+
+        print(f"{name:>10}: {old * 1000:10.2f} ms -> {new * 1000:10.2f} ms "
+              f"({change:+7.1%}) {flag}")
+
+    if regressions:
+        sys.exit(1)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark ugit commands")
+
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run")
+    run_parser.set_defaults(func=run)
+    run_parser.add_argument("benchmarks", nargs="*")
+    run_parser.add_argument("--repo", help="benchmark an existing repository")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("-o", "--output")
+    generate.add_generate_arguments(run_parser)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.set_defaults(func=compare)
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument(
+        "--statistic", choices=("min", "median"), default="median")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import os
+import random
+from typing import Dict, Optional
+
+from ugit import base
+from ugit import data
+from ugit import repository
+from ugit import storage
+
+DIR_FANOUT = 8
+TOPIC_BRANCH = "topic"
+
+
+def generate(path: str, files: int = 1000, depth: int = 3, history: int = 50,
+             branchiness: float = 0.1, blob_size: int = 4096, changes: int = 10,
+             object_store: str = "loose", object_format: str = "sha1", seed: int = 0):
+    rng = random.Random(seed)
+    os.makedirs(path)
+
+    with data.use_repository(data.open_repository(path)):
+        base.init(object_store, object_format=object_format)
+
+        tree = {}
+
+        with data.write_batch(fsync=False):
+            for index in range(files):
+                tree[_random_path(rng, depth, index)] = data.hash_object(
+                    _random_blob(rng, blob_size))
+
+        trees = {"master": tree}
+        current = "master"
+        merging = None
+
+        for number in range(history):
+            roll = rng.random()
+            other = None
+
+            if merging:
+                other, merging = merging, None
+            elif number and current == "master" and roll < branchiness:
+                current = f"branch-{len(trees)}"
+                base.create_branch(current, base.get_object_id("master"))
+                trees[current] = dict(trees["master"])
+            elif number and roll < 2 * branchiness:
+                current = "master"
+                other = _pick_unmerged_branch(rng, trees)
+
+                if other and not _has_diverged(other):
+                    merging, other = other, None
+
+            _switch_branch(current)
+
+            if other:
+                trees[current] = _merge_tree(trees[current], trees[other], other)
+                data.update_ref("MERGE_HEAD", data.RefValue(
+                    symbolic=False, value=base.get_object_id(other)))
+
+            _commit_changes(rng, trees[current], changes, blob_size, f"commit {number}")
+
+        _switch_branch("master")
+        master = data.get_ref("HEAD").value
+        master_parents = base.get_commit(master).parents
+
+        if master_parents:
+            base.create_branch(TOPIC_BRANCH, master_parents[0])
+            _switch_branch(TOPIC_BRANCH)
+            tree = base.get_tree(base.get_commit(master_parents[0]).tree)
+            _commit_changes(rng, tree, changes, blob_size, "topic commit")
+
+        base.checkout("master")
+
+
+def _commit_changes(rng: random.Random, tree: Dict[str, str], changes: int, blob_size: int, message: str):
+    with data.write_batch(fsync=False):
+        for path in rng.sample(sorted(tree), min(changes, len(tree))):
+            tree[path] = data.hash_object(_random_blob(rng, blob_size))
+
+        with data.get_index() as index:
+            index.clear()
+            index.update(tree)
+
+        base.commit(message)
+
+
+def _pick_unmerged_branch(rng: random.Random, trees: Dict[str, Dict[str, str]]) -> Optional[str]:
+    master = base.get_object_id("master")
+    unmerged = [branch for branch in sorted(trees) if branch != "master"
+                and not base.is_ancestor_of(master, base.get_object_id(branch))]
+
+    return rng.choice(unmerged) if unmerged else None
+
+
+def _has_diverged(branch: str) -> bool:
+    master = base.get_object_id("master")
+
+    return base.get_merge_base(base.get_object_id(branch), master) != master
+
+
+def _merge_tree(tree: Dict[str, str], tree_other: Dict[str, str], other: str) -> Dict[str, str]:
+    merge_base = base.get_merge_base(
+        base.get_object_id(other), base.get_object_id("master"))
+    tree_base = base.get_tree(base.get_commit(merge_base).tree)
+
+    merged = dict(tree)
+    merged.update((path, object_id) for path, object_id in tree_other.items()
+                  if tree_base.get(path) != object_id)
+
+    return merged
+
+
+def _switch_branch(branch: str):
+    data.update_ref("HEAD", data.RefValue(
+        symbolic=True, value=os.path.join("refs", "heads", branch)), deref=False)
+
+
+def _random_path(rng: random.Random, depth: int, index: int) -> str:
+    dirnames = [f"dir{rng.randrange(DIR_FANOUT)}"
+                for _ in range(rng.randint(0, depth))]
+
+    return os.path.join(*dirnames, f"file{index}.txt")
+
+
+def _random_blob(rng: random.Random, size: int) -> bytes:
+    lines = []
+    length = 0
+
+    while length < size:
+        line = f"{rng.getrandbits(64):016x} {rng.getrandbits(128):032x}\n"
+        lines.append(line)
+        length += len(line)
+
+    return "".join(lines).encode()[:size]
+
+
+def add_generate_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--history", type=int, default=50)
+    parser.add_argument("--branchiness", type=float, default=0.1)
+    parser.add_argument("--blob-size", type=int, default=4096)
+    parser.add_argument("--changes", type=int, default=10)
+    parser.add_argument("--object-store",
+                        choices=storage.OBJECT_STORES, default="loose")
+    parser.add_argument("--object-format",
+                        choices=repository.OBJECT_FORMATS, default="sha1")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generate_from_args(path: str, args: argparse.Namespace):
+    generate(path, files=args.files, depth=args.depth, history=args.history,
+             branchiness=args.branchiness, blob_size=args.blob_size,
+             changes=args.changes, object_store=args.object_store,
+             object_format=args.object_format, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic ugit repository")
+    parser.add_argument("path")
+    add_generate_arguments(parser)
+
+    args = parser.parse_args()
+    generate_from_args(args.path, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict
+
+from ugit.repository import OBJECT_FORMATS
+
+
+def measure(object_format: str, size: int, total: int) -> Dict[str, float]:
+    hash_function = OBJECT_FORMATS[object_format]
+    buffer = os.urandom(size)
+    rounds = max(total // size, 1)
+
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        hash_function(buffer).hexdigest()
+
+    elapsed = time.perf_counter() - start
+
+    return {
+        "seconds": elapsed,
+        "bytes": rounds * size,
+        "mb_per_second": rounds * size / elapsed / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure object id hashing throughput")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1024, 64 * 1024, 1024 * 1024])
+    parser.add_argument("--total", type=int, default=256 * 1024 * 1024,
+                        help="bytes hashed per format and size")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+
+    results = {}
+
+    for object_format in OBJECT_FORMATS:
+        results[object_format] = {}
+
+        for size in args.sizes:
+            result = measure(object_format, size, args.total)
+            results[object_format][str(size)] = result
+            print(f"{object_format:>8} {size:>10} B: {result['mb_per_second']:10.1f} MB/s",
+                  file=sys.stderr)
+
+    report = {"results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,21 @@
 
-from genericpath import exists
+import heapq
 import itertools
 import operator
 import os
 import string
-from typing import Deque, Dict, Iterator, List, Tuple
+import time
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from collections import deque, namedtuple
 
+from . import bloom
 from . import data
 from . import diff
+from . import trace
 
 
-def init():
-    data.init()
+def init(object_store: str = "loose", chunk_threshold: int = None, object_format: str = "sha1"):
+    data.init(object_store, chunk_threshold, object_format)
     data.update_ref("HEAD", data.RefValue(
         symbolic=True, value=os.path.join("refs", "heads", "master")))
 
@@ -58,7 +61,11 @@ def get_branch_name():
     return os.path.relpath(head, os.path.join("refs", "heads"))
 
 
-Commit = namedtuple("Commit", ["tree", "parents", "message"])
+Commit = namedtuple("Commit", ["tree", "parents", "message", "date"],
+                    defaults=(None,))
+
+ORDERS = ("date", "topo")
+COMMIT_GRAPH_FILL_LIMIT = 1000
 
 
 def iter_branch_names():
@@ -72,6 +79,7 @@ def is_branch(branch: str) -> bool:
 
 def get_commit(object_id: str) -> Commit:
     parents = []
+    date = None
 
     commit = data.get_object(object_id, 'commit').decode()
     lines = iter(commit.splitlines())
@@ -83,36 +91,51 @@ def get_commit(object_id: str) -> Commit:
             tree = value
         elif key == 'parent':
             parents.append(value)
+        elif key == 'date':
+            date = int(value)
         else:
             assert False, f'Unknown field {key}'
 
     message = '\n'.join(lines)
-    return Commit(tree=tree, parents=parents, message=message)
+    return Commit(tree=tree, parents=parents, message=message, date=date)
 
 
 def commit(massage: str) -> str:
-    commit = f"tree {write_tree()}\n"
-
     head = data.get_ref("HEAD").value
-    if head:
-        commit += f"parent {head}\n"
-
     merge_head = data.get_ref("MERGE_HEAD").value
 
-    if merge_head:
-        commit += f"parent {merge_head}\n"
-        data.delete_ref("MERGE_HEAD", defer=False)
+    with data.write_batch():
+        object_id = _write_commit(massage, [head, merge_head])
 
-    commit += "\n"
-    commit += f"{massage}\n"
+    with data.get_commit_graph() as commit_graph:
+        _get_commit_info(commit_graph, object_id, COMMIT_GRAPH_FILL_LIMIT)
+        _add_changed_paths_filter(commit_graph, object_id)
 
-    object_id = data.hash_object(commit.encode(), "commit")
+    updates = [data.RefUpdate("HEAD", data.RefValue(symbolic=False, value=object_id),
+                              expected=data.RefValue(symbolic=False, value=head))]
 
-    data.update_ref("HEAD", data.RefValue(symbolic=False, value=object_id))
+    if merge_head:
+        updates.append(data.RefUpdate("MERGE_HEAD", None, deref=False,
+                                      expected=data.RefValue(symbolic=False, value=merge_head)))
+
+    data.update_refs(updates)
 
     return object_id
 
 
+def _write_commit(massage: str, parents: List[str]) -> str:
+    commit = f"tree {write_tree()}\n"
+
+    for parent in filter(None, parents):
+        commit += f"parent {parent}\n"
+
+    commit += f"date {int(time.time())}\n"
+    commit += "\n"
+    commit += f"{massage}\n"
+
+    return data.hash_object(commit.encode(), "commit")
+
+
 def write_tree() -> str:
     index_as_tree = {}
 
@@ -122,7 +145,7 @@ def write_tree() -> str:
 
             current = index_as_tree
 
-            for direname in dirpath:
+            for direname in filter(None, dirpath.split("/")):
                 current = current.setdefault(direname, {})
 
             current[filename] = object_id
@@ -146,7 +169,8 @@ def write_tree() -> str:
 
         return data.hash_object(tree.encode(), "tree")
 
-    return write_tree_recursive(index_as_tree)
+    with trace.phase("write_tree"), data.write_batch():
+        return write_tree_recursive(index_as_tree)
 
 
 def is_ignored(path: str) -> bool:
@@ -176,34 +200,40 @@ def read_tree_merged(tree_base: str, tree_head: str, tree_other: str, update_wor
 
 
 def _checkout_index(index):
-    _empty_current_directory()
+    worktree = data.get_repository().worktree
 
-    for path, object_id in index.items():
-        os.makedirs(os.path.dirname(os.path.join("./", path)), exist_ok=True)
+    with trace.phase("checkout_index"):
+        _empty_current_directory()
 
-        with open(path, "wb") as f:
-            f.write(data.get_object(object_id, "blob"))
+        for path, object_id in index.items():
+            path = os.path.join(worktree, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path, "wb") as f:
+                for chunk in data.iter_blob_chunks(object_id):
+                    f.write(chunk)
 
 
 def get_index_tree():
-    with data.get_index() as index:
-        return index
+    return data.read_index()
 
 
 def _empty_current_directory():
-    for root, dirnames, filenames in os.walk(".", topdown=False):
+    worktree = data.get_repository().worktree
+
+    for root, dirnames, filenames in os.walk(worktree, topdown=False):
         for filename in filenames:
-            path = os.path.relpath(os.path.join(root, filename))
+            path = os.path.join(root, filename)
 
-            if is_ignored(path) or not os.path.isfile(path):
+            if is_ignored(os.path.relpath(path, worktree)) or not os.path.isfile(path):
                 continue
 
             os.remove(path)
 
         for dirname in dirnames:
-            path = os.path.relpath(os.path.join(root, dirname))
+            path = os.path.join(root, dirname)
 
-            if is_ignored(path):
+            if is_ignored(os.path.relpath(path, worktree)):
                 continue
 
             try:
@@ -248,7 +278,7 @@ def get_object_id(name: str) -> str:
 
     is_hex = all(c in string.hexdigits for c in name)
 
-    if len(name) == 40 and is_hex:
+    if len(name) == data.get_repository().object_id_length and is_hex:
         return name
 
     assert False, f"Unkown name {name}"
@@ -284,6 +314,234 @@ def iter_commits_and_parents(object_ids: Deque[str]) -> Iterator[str]:
         object_ids.extend(commit.parents[1:])
 
 
+def get_changed_paths(object_id: str) -> Set[str]:
+    commit = get_commit(object_id)
+    parent_tree = commit.parents and get_commit(commit.parents[0]).tree
+
+    return set(_iter_changed_paths(parent_tree, commit.tree))
+
+
+def _iter_changed_paths(tree_from: str, tree_to: str, base_path: str = "") -> Iterator[str]:
+    if tree_from == tree_to:
+        return
+
+    entries_from = {name: (fmt, object_id)
+                    for fmt, object_id, name in _iter_tree_entries(tree_from)}
+    entries_to = {name: (fmt, object_id)
+                  for fmt, object_id, name in _iter_tree_entries(tree_to)}
+
+    for name in sorted(entries_from.keys() | entries_to.keys()):
+        entry_from = entries_from.get(name, (None, None))
+        entry_to = entries_to.get(name, (None, None))
+
+        if entry_from == entry_to:
+            continue
+
+        path = base_path + name
+
+        if "blob" in (entry_from[0], entry_to[0]):
+            yield path
+
+        subtree_from = entry_from[1] if entry_from[0] == "tree" else None
+        subtree_to = entry_to[1] if entry_to[0] == "tree" else None
+
+        if subtree_from or subtree_to:
+            yield from _iter_changed_paths(subtree_from, subtree_to, f"{path}/")
+
+
+def iter_commits_touching_paths(object_ids: Iterable[str], paths: List[str]) -> Iterator[str]:
+    paths = [bloom.normalize_path(path) for path in paths]
+
+    with data.get_commit_graph() as commit_graph:
+        for object_id in object_ids:
+            changed_paths = None
+
+            if "bloom" not in commit_graph.get(object_id, {}):
+                changed_paths = _add_changed_paths_filter(
+                    commit_graph, object_id)
+
+            bloom_filter = commit_graph[object_id]["bloom"]
+
+            if not any(bloom.might_contain(bloom_filter, path) for path in paths):
+                trace.count("bloom.filtered")
+                continue
+
+            trace.count("bloom.maybe")
+
+            if changed_paths is None:
+                changed_paths = get_changed_paths(object_id)
+
+            if any(_is_path_touched(path, changed_paths) for path in paths):
+                yield object_id
+
+
+def _add_changed_paths_filter(commit_graph: Dict[str, dict], object_id: str) -> Set[str]:
+    changed_paths = get_changed_paths(object_id)
+    commit_graph[object_id] = {**commit_graph.get(object_id, {}),
+                               "bloom": bloom.create(changed_paths)}
+
+    return changed_paths
+
+
+def write_commit_graph(object_ids: Iterable[str]):
+    with trace.phase("write_commit_graph"), data.get_commit_graph() as commit_graph:
+        for object_id in filter(None, object_ids):
+            _get_commit_info(commit_graph, object_id)
+
+
+def _get_commit_info(commit_graph: Dict[str, dict], object_id: str, limit: int = None) -> Optional[dict]:
+    stack = [object_id]
+    parsed = 0
+
+    while stack:
+        current = stack[-1]
+
+        if "generation" in commit_graph.get(current, {}):
+            stack.pop()
+            continue
+
+        if limit is not None and parsed >= limit:
+            return None
+
+        parsed += 1
+        commit = get_commit(current)
+        missing = [parent for parent in commit.parents
+                   if "generation" not in commit_graph.get(parent, {})]
+
+        if missing:
+            stack.extend(missing)
+            continue
+
+        parents = [commit_graph[parent] for parent in commit.parents]
+        date = commit.date or 0
+
+        commit_graph[current] = {
+            **commit_graph.get(current, {}),
+            "parents": commit.parents,
+            "date": date,
+            "generation": 1 + max((parent["generation"] for parent in parents), default=0),
+            "corrected_date": max([date] + [parent["corrected_date"] + 1 for parent in parents]),
+        }
+        stack.pop()
+
+    return commit_graph[object_id]
+
+
+def iter_commits(object_ids: Iterable[str], exclude: Iterable[str] = (), order: str = "date", since: int = None) -> Iterator[str]:
+    assert order in ORDERS, f"Unknown order {order}"
+
+    exclude = list(filter(None, exclude))
+    object_ids = list(filter(None, object_ids))
+
+    with data.get_commit_graph() as commit_graph:
+        has_generations = all(_get_commit_info(commit_graph, object_id, COMMIT_GRAPH_FILL_LIMIT)
+                              for object_id in exclude + object_ids)
+
+        if not has_generations:
+            trace.count("commit_graph.fallback")
+
+        queue = []
+        uninteresting = {}
+        popped = set()
+        interesting_count = 0
+
+        def push(object_id: str, is_uninteresting: bool):
+            nonlocal interesting_count
+
+            if object_id in uninteresting:
+                if is_uninteresting and not uninteresting[object_id]:
+                    uninteresting[object_id] = True
+                    interesting_count -= 1
+                return
+
+            if object_id in popped:
+                return
+
+            info = _get_walk_info(commit_graph, object_id)
+
+            if not has_generations:
+                key = (-info["date"], 0)
+            elif order == "topo":
+                key = (-info["generation"], -info["corrected_date"])
+            else:
+                key = (-info["corrected_date"], -info["generation"])
+
+            heapq.heappush(queue, (*key, object_id))
+            uninteresting[object_id] = is_uninteresting
+            interesting_count += not is_uninteresting
+
+        for object_id in exclude:
+            push(object_id, True)
+
+        for object_id in object_ids:
+            push(object_id, False)
+
+        while queue and interesting_count:
+            *_, object_id = heapq.heappop(queue)
+            is_uninteresting = uninteresting.pop(object_id)
+            interesting_count -= not is_uninteresting
+
+            if not has_generations:
+                popped.add(object_id)
+
+            info = _get_walk_info(commit_graph, object_id)
+
+            for parent in info["parents"]:
+                push(parent, is_uninteresting)
+
+            if is_uninteresting:
+                continue
+
+            if since is not None and info["date"] < since:
+                if order == "date" and has_generations and info["corrected_date"] < since:
+                    break
+
+                continue
+
+            yield object_id
+
+
+def _get_walk_info(commit_graph: Dict[str, dict], object_id: str) -> dict:
+    info = commit_graph.get(object_id, {})
+
+    if "generation" in info:
+        return info
+
+    commit = get_commit(object_id)
+
+    return {"parents": commit.parents, "date": commit.date or 0}
+
+
+def get_commit_parents(object_id: str) -> List[str]:
+    with data.get_commit_graph() as commit_graph:
+        return _get_walk_info(commit_graph, object_id)["parents"]
+
+
+def parse_revisions(revisions: List[str]) -> Tuple[List[str], List[str]]:
+    include = []
+    exclude = []
+
+    for revision in revisions or ["@"]:
+        if revision.startswith("^"):
+            exclude.append(get_object_id(revision[1:]))
+        elif ".." in revision:
+            start, end = revision.split("..", 1)
+            exclude.append(get_object_id(start or "@"))
+            include.append(get_object_id(end or "@"))
+        else:
+            include.append(get_object_id(revision))
+
+    return include, exclude
+
+
+def _is_path_touched(path: str, changed_paths: Set[str]) -> bool:
+    if path == ".":
+        return bool(changed_paths)
+
+    return any(changed == path or changed.startswith(f"{path}/")
+               for changed in changed_paths)
+
+
 def iter_objects_in_commits(object_ids: List[str]) -> Iterator[str]:
     visited = set()
 
@@ -299,6 +557,7 @@ def iter_objects_in_commits(object_ids: List[str]) -> Iterator[str]:
                 else:
                     visited.add(object_id)
                     yield object_id
+                    yield from data.get_chunk_ids(object_id)
 
     for object_id in iter_commits_and_parents(object_ids):
         yield object_id
@@ -310,17 +569,22 @@ def iter_objects_in_commits(object_ids: List[str]) -> Iterator[str]:
 
 
 def get_working_tree() -> Dict[str, str]:
+    worktree = data.get_repository().worktree
     result = {}
 
-    for root, _, filenames in os.walk("."):
-        for filename in filenames:
-            path = os.path.relpath(os.path.join(root, filename))
+    with trace.phase("working_tree"), data.get_file_hashes() as file_hashes:
+        for root, _, filenames in os.walk(worktree):
+            for filename in filenames:
+                full_path = os.path.join(root, filename)
+                path = os.path.relpath(full_path, worktree)
 
-            if is_ignored(path) or not os.path.isfile(path):
-                continue
+                if is_ignored(path) or not os.path.isfile(full_path):
+                    continue
+
+                result[path] = data.hash_file(full_path, file_hashes)
 
-            with open(path, "rb") as f:
-                result[path] = data.hash_object(f.read())
+        for path in set(file_hashes) - set(result):
+            del file_hashes[path]
 
     return result
 
@@ -363,17 +627,15 @@ def is_ancestor_of(commit: str, maybe_ancestor: str) -> bool:
 
 
 def add(filenames: List[str]):
-    def add_file(filename: str):
-        filename = os.path.relpath(filename)
-
-        with open(filename, 'rb') as f:
-            object_id = data.hash_object(f.read())
+    worktree = data.get_repository().worktree
 
-        index[filename] = object_id
+    def add_file(filename: str):
+        object_id = data.hash_file(filename, file_hashes)
+        index[os.path.relpath(filename, worktree)] = object_id
 
     def add_directory(dirname: str):
-        for root, _, filename in os.walk(dirname):
-            for filename in filenames:
+        for root, _, dir_filenames in os.walk(dirname):
+            for filename in dir_filenames:
                 path = os.path.relpath(os.path.join(root, filename))
 
                 if is_ignored(path) or not os.path.isfile(path):
@@ -381,7 +643,7 @@ def add(filenames: List[str]):
 
                 add_file(path)
 
-    with data.get_index() as index:
+    with data.get_index() as index, data.get_file_hashes() as file_hashes, data.write_batch():
         for name in filenames:
             if os.path.isfile(name):
                 add_file(name)
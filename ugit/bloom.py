@@ -0,0 +1,61 @@
+import hashlib
+import os
+from typing import Iterable, Iterator, List, Optional
+
+BITS_PER_ENTRY = 10
+NUM_HASHES = 7
+MIN_BITS = 64
+MAX_CHANGED_PATHS = 512
+
+
+def create(paths: Iterable[str]) -> Optional[str]:
+    keys = set()
+
+    for path in paths:
+        keys.update(iter_path_keys(path))
+
+    if len(keys) > MAX_CHANGED_PATHS:
+        return None
+
+    num_bits = max(len(keys) * BITS_PER_ENTRY, MIN_BITS)
+    num_bits += -num_bits % 8
+    bits = bytearray(num_bits // 8)
+
+    for key in keys:
+        for position in _bit_positions(key, num_bits):
+            bits[position // 8] |= 1 << (position % 8)
+
+    return bits.hex()
+
+
+def might_contain(bloom_filter: Optional[str], path: str) -> bool:
+    path = normalize_path(path)
+
+    if bloom_filter is None or path == ".":
+        return True
+
+    bits = bytes.fromhex(bloom_filter)
+    num_bits = len(bits) * 8
+
+    return all(bits[position // 8] & (1 << (position % 8))
+               for position in _bit_positions(path, num_bits))
+
+
+def iter_path_keys(path: str) -> Iterator[str]:
+    path = normalize_path(path)
+
+    while path and path != ".":
+        yield path
+        path = os.path.dirname(path)
+
+
+def normalize_path(path: str) -> str:
+    return os.path.normpath(path).strip("/")
+
+
+def _bit_positions(key: str, num_bits: int) -> List[int]:
+    digest = hashlib.sha1(key.encode()).digest()
+    first = int.from_bytes(digest[:8], "little")
+    second = int.from_bytes(digest[8:16], "little") | 1
+
+    return [(first + i * second) % num_bits for i in range(NUM_HASHES)]
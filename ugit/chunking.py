@@ -0,0 +1,99 @@
+import hashlib
+from typing import Iterator, List, Optional, Tuple
+
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+WINDOW_BITS = 5
+SEGMENT_SIZE = 1024 * 1024
+
+_WINDOW_SIZE = 1 << WINDOW_BITS
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:2], "little")
+         for value in range(256)]
+_GEAR_LOW = bytes(value & 0xff for value in _GEAR)
+_GEAR_HIGH = bytes(value >> 8 for value in _GEAR)
+
+
+def iter_chunks(content: bytes) -> Iterator[bytes]:
+    finder = _BoundaryFinder(content)
+    start = 0
+
+    while start < len(content):
+        if len(content) - start <= MIN_CHUNK_SIZE:
+            end = len(content)
+        else:
+            limit = min(start + MAX_CHUNK_SIZE, len(content))
+            position = finder.find(start + MIN_CHUNK_SIZE, limit)
+            end = limit if position is None else position + 1
+
+        yield content[start:end]
+        start = end
+
+
+class _BoundaryFinder:
+    def __init__(self, content: bytes):
+        self._content = content
+        self._segment_start = None
+        self._hashes = None
+
+    def find(self, start: int, end: int) -> Optional[int]:
+        while start < end:
+            segment_start = start - start % SEGMENT_SIZE
+            segment_end = min(segment_start + SEGMENT_SIZE, end)
+
+            if segment_start != self._segment_start:
+                self._segment_start = segment_start
+                self._hashes = _window_hashes(self._content, segment_start)
+
+            offset = 2 * (start - segment_start)
+
+            while True:
+                offset = self._hashes.find(
+                    b"\x00\x00", offset, 2 * (segment_end - segment_start))
+
+                if offset == -1 or offset % 2 == 0:
+                    break
+
+                offset += 1
+
+            if offset != -1:
+                return segment_start + offset // 2
+
+            start = segment_end
+
+        return None
+
+
+def _window_hashes(content: bytes, segment_start: int) -> bytes:
+    window_start = max(segment_start - _WINDOW_SIZE + 1, 0)
+    segment = content[window_start:segment_start + SEGMENT_SIZE]
+    size = len(segment)
+
+    fields = bytearray(4 * size)
+    fields[0::4] = segment.translate(_GEAR_LOW)
+    fields[1::4] = segment.translate(_GEAR_HIGH)
+    sums = int.from_bytes(fields, "little")
+
+    for step in range(WINDOW_BITS):
+        sums += sums << (32 << step)
+
+    sums = sums.to_bytes(max((sums.bit_length() + 7) // 8, 4 * size), "little")
+
+    hashes = bytearray(2 * size)
+    hashes[0::2] = sums[0:4 * size:4]
+    hashes[1::2] = sums[1:4 * size:4]
+
+    return bytes(hashes[2 * (segment_start - window_start):])
+
+
+def create_manifest(chunks: List[Tuple[str, int]]) -> bytes:
+    return "".join(f"{object_id} {size}\n" for object_id, size in chunks).encode()
+
+
+def parse_manifest(manifest: bytes) -> List[Tuple[str, int]]:
+    chunks = []
+
+    for line in manifest.decode().splitlines():
+        object_id, size = line.split(" ")
+        chunks.append((object_id, int(size)))
+
+    return chunks
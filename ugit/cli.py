@@ -1,25 +1,58 @@
 
 import argparse
-import subprocess
+import datetime
+import itertools
 import os
 import sys
 import textwrap
-from typing import Dict
+import time
+from typing import Dict, List, Optional
 
 from . import base
 from . import data
 from . import diff
+from . import fsck
+from . import graph
+from . import grep
 from . import remote
+from . import repository
+from . import storage
+from . import trace
 
 
 def main():
-    with data.change_git_dir('.'):
-        args = parse_args()
-        args.func(args)
+    trace.enable_from_env()
+
+    try:
+        with data.use_repository(data.open_repository(".")):
+            args = parse_args()
+
+            if args.trace:
+                trace.enable(args.trace)
+
+            with trace.phase(args.command):
+                args.func(args)
+    finally:
+        if trace.ENABLED:
+            trace.print_report()
+
+
+PATH_COMMANDS = ("log", "grep")
 
 
 def parse_args():
+    argv = sys.argv[1:]
+    paths = []
+
+    if "--" in argv:
+        separator = argv.index("--")
+
+        if _get_command(argv[:separator]) in PATH_COMMANDS:
+            argv, paths = argv[:separator], argv[separator + 1:]
+
     parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", nargs="?",
+                        const="summary", choices=trace.MODES)
 
     commands = parser.add_subparsers(dest="command")
     commands.required = True
@@ -28,6 +61,11 @@ def parse_args():
 
     init_parser = commands.add_parser("init")
     init_parser.set_defaults(func=init)
+    init_parser.add_argument(
+        "--object-store", choices=storage.OBJECT_STORES, default="loose")
+    init_parser.add_argument("--chunk-threshold", type=int)
+    init_parser.add_argument(
+        "--object-format", choices=repository.OBJECT_FORMATS, default="sha1")
 
     hash_object_parser = commands.add_parser("hash-object")
     hash_object_parser.set_defaults(func=hash_object)
@@ -50,7 +88,16 @@ def parse_args():
 
     log_parser = commands.add_parser("log")
     log_parser.set_defaults(func=log)
-    log_parser.add_argument("oid", type=oid, default="@", nargs="?")
+    log_parser.add_argument("revisions", nargs="*", default=["@"])
+    log_parser.add_argument("-n", "--max-count", type=int)
+    log_parser.add_argument("--graph", action="store_true")
+    log_parser.add_argument("--since", type=_parse_date)
+    order_group = log_parser.add_mutually_exclusive_group()
+    order_group.add_argument("--topo-order", dest="order",
+                             action="store_const", const="topo")
+    order_group.add_argument("--date-order", dest="order",
+                             action="store_const", const="date")
+    log_parser.set_defaults(order="date")
 
     checkout_parser = commands.add_parser("checkout")
     checkout_parser.set_defaults(func=checkout)
@@ -63,6 +110,12 @@ def parse_args():
 
     k_parser = commands.add_parser("k")
     k_parser.set_defaults(func=k)
+    k_parser.add_argument("revisions", nargs="*")
+    k_parser.add_argument("-n", "--max-count", type=int)
+    k_parser.add_argument(
+        "--format", choices=graph.EXPORT_FORMATS, default="dot")
+    k_parser.add_argument("-o", "--output")
+    k_parser.add_argument("--simplify", action="store_true")
 
     branch_parser = commands.add_parser("branch")
     branch_parser.set_defaults(func=branch)
@@ -103,17 +156,46 @@ def parse_args():
     push_parser.add_argument("remote")
     push_parser.add_argument("branch")
 
+    grep_parser = commands.add_parser("grep")
+    grep_parser.set_defaults(func=grep_cmd)
+    grep_parser.add_argument("pattern")
+    grep_parser.add_argument("oid", default="@", type=oid, nargs="?")
+    grep_parser.add_argument("-i", "--ignore-case", action="store_true")
+    grep_parser.add_argument("-j", "--jobs", type=int)
+
+    fsck_parser = commands.add_parser("fsck")
+    fsck_parser.set_defaults(func=fsck_cmd)
+    fsck_parser.add_argument("--reachable", action="store_true")
+    fsck_parser.add_argument("--progress", action="store_true")
+    fsck_parser.add_argument("-j", "--jobs", type=int)
+
+    commit_graph_parser = commands.add_parser("commit-graph")
+    commit_graph_parser.set_defaults(func=commit_graph)
+
     add_pareser = commands.add_parser("add")
     add_pareser.set_defaults(func=add)
     add_pareser.add_argument("files", nargs="+")
 
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    args.paths = paths
+
+    return args
+
+
+def _get_command(argv: List[str]) -> Optional[str]:
+    for arg in argv:
+        if arg == "--trace" or arg.startswith("--trace=") or arg in trace.MODES:
+            continue
+
+        return arg
+
+    return None
 
 
 def init(args: argparse.Namespace):
-    base.init()
+    base.init(args.object_store, args.chunk_threshold, args.object_format)
     print(
-        f"Initialized empty ugit repository in {os.path.join(os.getcwd(), data.GIT_DIR)}")
+        f"Initialized empty ugit repository in {data.get_repository().git_dir}")
 
 
 def hash_object(args: argparse.Namespace):
@@ -144,9 +226,34 @@ def log(args: argparse.Namespace):
     for refname, ref in data.iter_refs():
         refs.setdefault(ref.value, []).append(refname)
 
-    for object_id in base.iter_commits_and_parents({args.oid}):
-        commit = base.get_commit(object_id)
-        _print_commit(object_id, commit, refs.get(object_id))
+    assert not (args.graph and args.paths), "--graph can't be used with paths"
+
+    include, exclude = base.parse_revisions(args.revisions)
+    object_ids = base.iter_commits(
+        include, exclude, order=args.order, since=args.since)
+
+    if args.paths:
+        object_ids = base.iter_commits_touching_paths(object_ids, args.paths)
+
+    commits = ((object_id, base.get_commit(object_id))
+               for object_id in itertools.islice(object_ids, args.max_count))
+
+    if args.graph:
+        commits, parents = itertools.tee(commits)
+        graph_rows = graph.iter_graph_rows(
+            (object_id, commit.parents) for object_id, commit in parents)
+    else:
+        graph_rows = itertools.repeat(None)
+
+    for (object_id, commit), graph_row in zip(commits, graph_rows):
+        _print_commit(object_id, commit, refs.get(object_id), graph_row)
+
+
+def _parse_date(value: str) -> int:
+    if value.isdigit():
+        return int(value)
+
+    return int(datetime.datetime.fromisoformat(value).timestamp())
 
 
 def checkout(args: argparse.Namespace):
@@ -158,31 +265,34 @@ def tag(args: argparse.Namespace):
 
 
 def k(args: argparse.Namespace):
-    dot = "digraph commits {\n"
-
+    refs = []
     object_ids = set()
 
     for refname, ref in data.iter_refs(deref=False):
-        dot += f'"{refname}" [shape = note]\n'
-        dot += f'"{refname}" -> {ref.value}'
+        refs.append((refname, ref.value))
 
         if not ref.symbolic:
             object_ids.add(ref.value)
 
-    for object_id in base.iter_commits_and_parents(object_ids):
-        commit = base.get_commit(object_id)
-        dot += f'"{object_id}" [shape=box style=filled label="{object_id[:10]}"]\n'
+    if args.revisions:
+        include, exclude = base.parse_revisions(args.revisions)
+    else:
+        include, exclude = object_ids, ()
 
-        for parent in commit.parents:
-            dot += f'"{object_id}" -> "{parent}"\n'
+    write = graph.write_json if args.format == "json" else graph.write_dot
 
-    dot += "}"
-    print(dot)
+    with data.get_commit_graph():
+        commits = itertools.islice(base.iter_commits(
+            include, exclude, order="topo"), args.max_count)
+        elements = graph.iter_graph_elements(
+            ((object_id, base.get_commit_parents(object_id)) for object_id in commits),
+            keep=object_ids, simplify=args.simplify)
 
-    with subprocess.Popen(
-        ["dot", "-Tx11", "/dev/stdin"],
-            stdin=subprocess.PIPE) as proc:
-        proc.communicate(dot.encode())
+        if args.output:
+            with open(args.output, "w") as f:
+                write(f, refs, elements)
+        else:
+            write(sys.stdout, refs, elements)
 
 
 def branch(args: argparse.Namespace):
@@ -237,21 +347,35 @@ def show(args: argparse.Namespace):
         parent_tree = base.get_commit(commit.parents[0]).tree
 
     _print_commit(args.oid, commit)
-    result = diff.diff_trees(
+    _write_diff(
         base.get_tree(parent_tree),
         base.get_tree(commit.tree)
     )
 
-    sys.stdout.flush()
-    sys.stdout.buffer.write(result)
-
 
-def _print_commit(object_id: str, commit: base.Commit, refs: Dict[str, str] = None):
+def _print_commit(object_id: str, commit: base.Commit, refs: Dict[str, str] = None, graph_row: graph.GraphRow = None):
     refs_str = f"({', '.join(refs)})" if refs else ""
+    lines = [f"commit {object_id}{refs_str}"]
+
+    if commit.date is not None:
+        lines.append(f"Date: {time.ctime(commit.date)}")
+
+    lines += ["", *textwrap.indent(commit.message, "			").split("\n"), ""]
+
+    if graph_row is None:
+        print("\n".join(lines))
+        return
+
+    for line in graph_row.edges_before:
+        print(line)
 
-    print(f"commit {object_id}{refs_str}\n")
-    print(textwrap.indent(commit.message, "			"))
-    print("")
+    print(graph_row.commit + lines[0])
+
+    for line in lines[1:]:
+        print(graph_row.padding + line)
+
+    for line in graph_row.edges_after:
+        print(line)
 
 
 def diff_cmd(args: argparse.Namespace):
@@ -274,10 +398,15 @@ def diff_cmd(args: argparse.Namespace):
         if not args.commit:
             tree_from = base.get_index_tree()
 
-    result = diff.diff_trees(tree_from, tree_to)
+    _write_diff(tree_from, tree_to)
 
+
+def _write_diff(tree_from: Dict[str, str], tree_to: Dict[str, str]):
     sys.stdout.flush()
-    sys.stdout.buffer.write(result)
+
+    for output in diff.diff_trees(tree_from, tree_to):
+        sys.stdout.buffer.write(output)
+        sys.stdout.buffer.flush()
 
 
 def merge(args: argparse.Namespace):
@@ -298,3 +427,50 @@ def push(args: argparse.Namespace):
 
 def add(args: argparse.Namespace):
     base.add(args.files)
+
+
+def commit_graph(args: argparse.Namespace):
+    base.write_commit_graph(ref.value for _, ref in data.iter_refs())
+
+
+def fsck_cmd(args: argparse.Namespace):
+    report = fsck.fsck(reachable_only=args.reachable, jobs=args.jobs,
+                       progress=fsck.print_progress if args.progress else None)
+
+    if args.progress:
+        print(file=sys.stderr)
+
+    for error in report.store_errors:
+        print(f"error in object store: {error}")
+
+    for object_id, error in report.corrupt.items():
+        print(f"corrupt object {object_id}: {error}")
+
+    for fmt, object_id, referrer in report.missing:
+        if referrer:
+            print(f"missing {fmt} {object_id} (referenced by {referrer})")
+        else:
+            print(f"missing object {object_id}")
+
+    for object_id, expected, actual, referrer in report.bad_types:
+        print(f"bad type for {object_id}: expected {expected}, got {actual} (referenced by {referrer})")
+
+    for fmt, object_id in report.dangling:
+        print(f"dangling {fmt} {object_id}")
+
+    print(f"checked {report.checked} objects")
+
+    if report.store_errors or report.corrupt or report.missing or report.bad_types:
+        sys.exit(1)
+
+
+def grep_cmd(args: argparse.Namespace):
+    found = False
+
+    for match in grep.grep(args.pattern, args.oid, args.paths,
+                           ignore_case=args.ignore_case, jobs=args.jobs):
+        found = True
+        print(f"{match.path}:{match.line_number}:{match.line}")
+
+    if not found:
+        sys.exit(1)
@@ -0,0 +1,73 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+
+class CommitGraphStore:
+    FILENAME = "commit-graph.sqlite"
+
+    def __init__(self, git_dir: str):
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            os.path.join(git_dir, self.FILENAME), check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS commits "
+                "(id TEXT PRIMARY KEY, record TEXT NOT NULL) WITHOUT ROWID")
+
+    def read(self, object_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT record FROM commits WHERE id = ?", (object_id,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def write(self, records: Dict[str, dict]):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO commits (id, record) VALUES (?, ?)",
+                ((object_id, json.dumps(record)) for object_id, record in records.items()))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CommitGraph:
+    def __init__(self, store: CommitGraphStore):
+        self._store = store
+        self._records: Dict[str, Optional[dict]] = {}
+        self._pending: Dict[str, dict] = {}
+
+    def get(self, object_id: str, default: dict = None) -> Optional[dict]:
+        if object_id not in self._records:
+            self._records[object_id] = self._store.read(object_id)
+
+        record = self._records[object_id]
+
+        return default if record is None else record
+
+    def __getitem__(self, object_id: str) -> dict:
+        record = self.get(object_id)
+
+        if record is None:
+            raise KeyError(object_id)
+
+        return record
+
+    def __contains__(self, object_id: str) -> bool:
+        return self.get(object_id) is not None
+
+    def __setitem__(self, object_id: str, record: dict):
+        self._records[object_id] = record
+        self._pending[object_id] = record
+
+    def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            self._store.write(pending)
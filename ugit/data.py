@@ -1,162 +1,124 @@
 from contextlib import contextmanager
-import hashlib
-import json
+import contextvars
 import os
-import shutil
-from typing import Iterator, Tuple
-import zlib
+import threading
+from typing import Iterator, List, Tuple
 
-from collections import namedtuple
+from . import storage
+from .repository import RefUpdate, RefValue, Repository
 
-GIT_DIR = None
+_current_repository = contextvars.ContextVar("repository", default=None)
+_repositories = {}
+_repositories_lock = threading.Lock()
 
 
-@contextmanager
-def change_git_dir(new_dir):
-    global GIT_DIR
-    old_dir = GIT_DIR
-    GIT_DIR = f'{new_dir}/.ugit'
-    yield
-    GIT_DIR = old_dir
-
+def open_repository(path: str = ".") -> Repository:
+    path = os.path.abspath(path)
 
-def init():
-    os.makedirs(GIT_DIR)
-    os.makedirs(os.path.join(GIT_DIR, "objects"))
+    with _repositories_lock:
+        if path not in _repositories:
+            _repositories[path] = Repository(path)
 
+        return _repositories[path]
 
-def hash_object(raw_file: bytes, fmt: str = "blob") -> str:
-    obj = fmt.encode() + b' ' + str(len(raw_file)).encode() + b'\x00' + raw_file
-    object_id = hashlib.sha1(obj).hexdigest()
 
-    path = os.path.join(GIT_DIR, "objects", object_id[0:2], object_id[2:])
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "wb") as f:
-        f.write(zlib.compress(obj))
+def get_repository() -> Repository:
+    repository = _current_repository.get()
 
-    return object_id
+    assert repository is not None, "No repository in use"
 
+    return repository
 
-def get_object(object_id: str, expected: str = "blob") -> bytes:
-    with open(os.path.join(GIT_DIR, "objects", object_id[0:2], object_id[2:]), "rb") as f:
-        obj = zlib.decompress(f.read())
 
-    space_index = obj.find(b' ')
-    fmt = obj[0:space_index].decode("ascii")
+@contextmanager
+def use_repository(repository: Repository):
+    token = _current_repository.set(repository)
 
-    null_index = obj.find(b'\x00', space_index)
-    size = int(obj[space_index:null_index].decode("ascii"))
+    try:
+        yield repository
+    finally:
+        _current_repository.reset(token)
 
-    content = obj[null_index + 1:]
 
-    assert size == len(content), f"bad length for object: {object_id}"
+def init(object_store: str = "loose", chunk_threshold: int = None, object_format: str = "sha1"):
+    get_repository().init(object_store, chunk_threshold, object_format)
 
-    if expected is not None:
-        assert fmt == expected, f"Expected {expected}, got {fmt}"
 
-    return content
+def get_config() -> dict:
+    return get_repository().get_config()
 
 
-RefValue = namedtuple("RefValue", ["symbolic", "value"])
+def get_object_store() -> storage.ObjectStore:
+    return get_repository().object_store
 
 
-def update_ref(ref: str, refValue: RefValue, deref: bool = True):
-    ref = _get_ref_internal(ref, deref)[0]
+def write_batch(fsync: bool = None, background: bool = True):
+    return get_repository().write_batch(fsync, background)
 
-    assert refValue.value
 
-    if refValue.symbolic:
-        value = f"ref: {refValue.value}"
-    else:
-        value = refValue.value
+def hash_object(raw_file: bytes, fmt: str = "blob") -> str:
+    return get_repository().hash_object(raw_file, fmt)
 
-    ref_path = os.path.join(GIT_DIR, ref)
-    os.makedirs(os.path.dirname(ref_path), exist_ok=True)
 
-    with open(ref_path, "w") as f:
-        f.write(value)
+def get_object(object_id: str, expected: str = "blob") -> bytes:
+    return get_repository().get_object(object_id, expected)
 
 
-def get_ref(ref: str, deref=True) -> RefValue:
-    return _get_ref_internal(ref, deref)[1]
+def hash_file(path: str, file_hashes: dict) -> str:
+    return get_repository().hash_file(path, file_hashes)
 
 
-def _get_ref_internal(ref: str, deref) -> Tuple[str, RefValue]:
-    ref_path = os.path.join(GIT_DIR, ref)
-    value = None
+def iter_blob_chunks(object_id: str) -> Iterator[bytes]:
+    return get_repository().iter_blob_chunks(object_id)
 
-    if os.path.isfile(ref_path):
-        with open(ref_path, "r") as f:
-            value = f.read().strip()
 
-    symbolic = bool(value) and value.startswith("ref:")
+def get_chunk_ids(object_id: str) -> List[str]:
+    return get_repository().get_chunk_ids(object_id)
 
-    if symbolic:
-        value = value.split(":", 1)[1].strip()
 
-        if deref:
-            return _get_ref_internal(value, deref)
+def update_ref(ref: str, refValue: RefValue, deref: bool = True, expected: RefValue = None):
+    get_repository().update_ref(ref, refValue, deref, expected)
 
-    return ref, RefValue(symbolic=symbolic, value=value)
 
+def update_refs(updates: List[RefUpdate]):
+    get_repository().update_refs(updates)
 
-def iter_refs(prefix: str = "", deref: bool = True) -> Iterator[Tuple[str, RefValue]]:
-    refs = ["HEAD", "MERGE_HEAD"]
 
-    for root, _, filenames in os.walk(os.path.join(GIT_DIR, "refs")):
-        root = os.path.relpath(root, GIT_DIR)
-        refs.extend(os.path.join(root, name) for name in filenames)
+def get_ref(ref: str, deref=True) -> RefValue:
+    return get_repository().get_ref(ref, deref)
 
-    for refname in refs:
-        if not refname.startswith(prefix):
-            continue
-        ref = get_ref(refname, deref=deref)
 
-        if ref.value:
-            yield refname, ref
+def iter_refs(prefix: str = "", deref: bool = True) -> Iterator[Tuple[str, RefValue]]:
+    return get_repository().iter_refs(prefix, deref)
 
 
-def delete_ref(ref: str, defer=True):
-    ref = _get_ref_internal(ref, defer)[0]
-    os.remove(os.path.join(GIT_DIR, ref))
+def delete_ref(ref: str, defer=True, expected: RefValue = None):
+    get_repository().delete_ref(ref, defer, expected)
 
 
 def object_exists(object_id: str) -> bool:
-    return os.path.isfile(os.path.join(GIT_DIR, "objects", object_id))
-
+    return get_repository().object_exists(object_id)
 
-def fetch_object_if_missing(object_id: str, remote_git_dir: str):
-    if object_exists(object_id):
-        return
 
-    remote_git_dir += "/.ugit"
+def fetch_object_if_missing(object_id: str, remote: Repository):
+    get_repository().fetch_object_if_missing(object_id, remote)
 
-    os.makedirs(os.path.join(GIT_DIR, "objects",
-                object_id[:2]), exist_ok=True)
 
-    shutil.copy(os.path.join(remote_git_dir, "objects", object_id[:2], object_id[2:]),
-                os.path.join(GIT_DIR, "objects", object_id[:2], object_id[2:]))
+def push_object(object_id: str, remote: Repository):
+    get_repository().push_object(object_id, remote)
 
 
-def push_object(object_id: str, remote_git_dir: str):
-    remote_git_dir += "/.ugit"
-
-    os.makedirs(os.path.join(remote_git_dir, "objects",
-                object_id[:2]), exist_ok=True)
+def get_index():
+    return get_repository().get_index()
 
-    shutil.copy(os.path.join(GIT_DIR, "objects", object_id[:2], object_id[2:]),
-                os.path.join(remote_git_dir, "objects", object_id[:2], object_id[2:]))
 
+def read_index() -> dict:
+    return get_repository().read_index()
 
-@contextmanager
-def get_index():
-    index = {}
 
-    if os.path.isfile(os.path.join(GIT_DIR, "index")):
-        with open(os.path.join(GIT_DIR, "index")) as f:
-            index = json.load(f)
+def get_file_hashes():
+    return get_repository().get_file_hashes()
 
-    yield index
 
-    with open(os.path.join(GIT_DIR, "index"), "w") as f:
-        json.dump(index, f)
+def get_commit_graph():
+    return get_repository().get_commit_graph()
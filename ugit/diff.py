@@ -1,22 +1,100 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
 import os
 import subprocess
+import zlib
 
-from collections import defaultdict
-from typing import Dict, Iterator, List, Tuple
+from collections import Counter, defaultdict, deque, namedtuple
+from typing import Deque, Dict, Iterable, Iterator, Optional, Tuple
 from tempfile import NamedTemporaryFile as Temp
 
 from . import data
+from . import trace
 
+DIFF_WORKERS = os.cpu_count() or 1
+DIFF_WINDOW = DIFF_WORKERS * 4
 
-def diff_trees(tree_from: Dict[str, str], tree_to: Dict[str, str]) -> bytes:
-    output = b""
+RENAME_THRESHOLD = 0.5
+CHUNK_SIZE = 64
+SIGNATURE_SIZE = 32
+SIGNATURE_BANDS = 16
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_SIGNATURE_SEEDS = [(zlib.crc32(b"a%d" % i) | 1, zlib.crc32(b"b%d" % i))
+                    for i in range(SIGNATURE_SIZE)]
+
+Rename = namedtuple("Rename", ["path_from", "path_to", "action", "similarity"])
+Sketch = namedtuple("Sketch", ["size", "chunks", "signature"])
+
+
+def diff_trees(tree_from: Dict[str, str], tree_to: Dict[str, str]) -> Iterator[bytes]:
+    executor = ThreadPoolExecutor(max_workers=DIFF_WORKERS)
+    rename_executor = ThreadPoolExecutor(max_workers=1)
+    modified = []
+    added_or_deleted = []
+
+    try:
+        renames = rename_executor.submit(
+            contextvars.copy_context().run, detect_renames, tree_from, tree_to)
+
+        for path, object_from, object_to in compare_trees(tree_from, tree_to):
+            if object_from and object_to:
+                if object_from != object_to:
+                    modified.append((bytes(path, "ascii") + b"\n", object_from, object_to))
+            else:
+                added_or_deleted.append((path, object_from, object_to))
+
+        yield from _iter_diff_output(executor, modified)
+        yield from _iter_diff_output(executor, _iter_renamed_entries(
+            tree_from, added_or_deleted, renames.result()))
+    finally:
+        executor.shutdown(cancel_futures=True)
+        rename_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_diff_output(executor: ThreadPoolExecutor, entries: Iterable[Tuple[bytes, str, str]]) -> Iterator[bytes]:
+    pending: Deque[Tuple[bytes, Optional[Future]]] = deque()
+
+    for header, object_from, object_to in entries:
+        future = None
 
-    for path, object_from, object_to in compare_trees(tree_from, tree_to):
         if object_from != object_to:
-            output += bytes(path, "ascii") + b"\n"
-            output += diff_blobs(object_from, object_to)
+            future = executor.submit(
+                contextvars.copy_context().run, diff_blobs, object_from, object_to)
 
-    return output
+        pending.append((header, future))
+
+        while pending and (len(pending) > DIFF_WINDOW or _is_ready(pending[0][1])):
+            yield _get_diff_output(*pending.popleft())
+
+    while pending:
+        yield _get_diff_output(*pending.popleft())
+
+
+def _iter_renamed_entries(tree_from: Dict[str, str], added_or_deleted: Iterable[Tuple[str, str, str]], renames: Dict[str, Rename]) -> Iterator[Tuple[bytes, str, str]]:
+    renamed_paths = {rename.path_from for rename in renames.values()
+                     if rename.action == "renamed"}
+
+    for path, object_from, object_to in added_or_deleted:
+        if path in renames:
+            rename = renames[path]
+            header = f"{rename.path_from} -> {path}"
+            yield bytes(header, "ascii") + b"\n", tree_from[rename.path_from], object_to
+        elif path in renamed_paths and not object_to:
+            continue
+        elif object_from != object_to:
+            yield bytes(path, "ascii") + b"\n", object_from, object_to
+
+
+def _is_ready(future: Optional[Future]) -> bool:
+    return future is None or future.done()
+
+
+def _get_diff_output(header: bytes, future: Optional[Future]) -> bytes:
+    if future is None:
+        return header
+
+    return header + future.result()
 
 
 def compare_trees(*trees: Dict[str, str]) -> Iterator[Tuple[str, str]]:
@@ -37,6 +115,8 @@ def diff_blobs(object_from: str, object_to: str, path: str = "blob") -> bytes:
                 f.write(data.get_object(object_id))
                 f.flush()
 
+        trace.count("subprocess.diff")
+
         with subprocess.Popen(
             ["diff", "--unified", "--show-c-function",
              "--label", os.path.join("a", path), file_from.name,
@@ -49,8 +129,17 @@ def diff_blobs(object_from: str, object_to: str, path: str = "blob") -> bytes:
 
 
 def iter_changed_files(tree_from: str, tree_to: str) -> Iterator[Tuple[str, str]]:
+    renames = detect_renames(tree_from, tree_to)
+    renamed_paths = {rename.path_from for rename in renames.values()
+                     if rename.action == "renamed"}
+
     for path, object_from, object_to in compare_trees(tree_from, tree_to):
-        if object_from != object_to:
+        if path in renames:
+            rename = renames[path]
+            yield f"{rename.path_from} -> {path}", rename.action
+        elif path in renamed_paths and not object_to:
+            continue
+        elif object_from != object_to:
             action = (
                 "new file" if not object_from else
                 "deleted" if not object_to else
@@ -62,21 +151,26 @@ def iter_changed_files(tree_from: str, tree_to: str) -> Iterator[Tuple[str, str]
 
 def merge_trees(tree_base: Dict[str, str], tree_head: Dict[str, str], tree_other: Dict[str, str]) -> Dict[str, bytes]:
     tree = {}
+    tree_base, tree_head, tree_other = _follow_renames(
+        tree_base, tree_head, tree_other)
 
-    for path, object_base, object_head, object_other in compare_trees(tree_base, tree_head, tree_other):
-        tree[path] = data.hash_object(merge_blobs(
-            object_base, object_head, object_other))
+    with trace.phase("merge_trees"), data.write_batch():
+        for path, object_base, object_head, object_other in compare_trees(tree_base, tree_head, tree_other):
+            tree[path] = data.hash_object(merge_blobs(
+                object_base, object_head, object_other))
 
     return tree
 
 
 def merge_blobs(object_base: str, object_head: str, object_other: str) -> bytes:
     with Temp() as file_base, Temp() as file_head, Temp() as file_other:
-        for object_id, file in ((object_base, file_base), (object_head, file_head), (object_other, file_head)):
+        for object_id, file in ((object_base, file_base), (object_head, file_head), (object_other, file_other)):
             if object_id:
                 file.write(data.get_object(object_id))
                 file.flush()
 
+        trace.count("subprocess.diff3")
+
         with subprocess.Popen(
             ["diff3", "-m",
              "-L", "HEAD", file_head.name,
@@ -88,3 +182,157 @@ def merge_blobs(object_base: str, object_head: str, object_other: str) -> bytes:
             assert proc.returncode in (0, 1)
 
     return output
+
+
+def _follow_renames(tree_base: Dict[str, str], tree_head: Dict[str, str], tree_other: Dict[str, str]) -> Tuple[Dict[str, str], ...]:
+    tree_base, tree_head, tree_other = dict(tree_base), dict(tree_head), dict(tree_other)
+
+    renames_head = detect_renames(tree_base, tree_head, find_copies=False)
+    renames_other = detect_renames(tree_base, tree_other, find_copies=False)
+
+    for renames, tree_unrenamed in ((renames_other, tree_head), (renames_head, tree_other)):
+        for rename in renames.values():
+            if rename.path_from not in tree_unrenamed or rename.path_to in tree_unrenamed:
+                continue
+
+            tree_unrenamed[rename.path_to] = tree_unrenamed.pop(rename.path_from)
+            tree_base[rename.path_to] = tree_base.pop(rename.path_from)
+
+    return tree_base, tree_head, tree_other
+
+
+def detect_renames(tree_from: Dict[str, str], tree_to: Dict[str, str], find_copies: bool = True) -> Dict[str, Rename]:
+    added = {path: object_id for path, object_id in tree_to.items()
+             if path not in tree_from}
+    deleted = {path: object_id for path, object_id in tree_from.items()
+               if path not in tree_to}
+    renames = {}
+
+    if not added:
+        return renames
+
+    deleted_by_id = defaultdict(list)
+    for path, object_id in sorted(deleted.items()):
+        deleted_by_id[object_id].append(path)
+
+    existing_by_id = {}
+    if find_copies:
+        for path, object_id in sorted(tree_from.items()):
+            existing_by_id.setdefault(object_id, path)
+
+    for path, object_id in sorted(added.items()):
+        if deleted_by_id.get(object_id):
+            path_from = deleted_by_id[object_id].pop(0)
+            renames[path] = Rename(path_from, path, "renamed", 1.0)
+        elif object_id in existing_by_id:
+            renames[path] = Rename(
+                existing_by_id[object_id], path, "copied", 1.0)
+
+    renamed_paths = {rename.path_from for rename in renames.values()}
+    sources = {path: object_id for path, object_id in deleted.items()
+               if path not in renamed_paths}
+
+    if find_copies:
+        sources.update((path, object_id) for path, object_id in tree_from.items()
+                       if path in tree_to and tree_to[path] != object_id)
+
+    targets = {path: object_id for path, object_id in added.items()
+               if path not in renames}
+
+    if sources and targets:
+        with trace.phase("detect_similar"):
+            renames.update(_detect_similar(sources, targets, deleted))
+
+    return renames
+
+
+def _detect_similar(sources: Dict[str, str], targets: Dict[str, str], deleted: Dict[str, str]) -> Dict[str, Rename]:
+    buckets = defaultdict(list)
+    sketches = {path: get_sketch(object_id) for path, object_id in sources.items()}
+
+    for path, sketch in sketches.items():
+        for band in _iter_signature_bands(sketch):
+            buckets[band].append(path)
+
+    pairs = []
+
+    for path_to, object_to in targets.items():
+        sketch_to = get_sketch(object_to)
+        candidates = set()
+
+        for band in _iter_signature_bands(sketch_to):
+            candidates.update(buckets.get(band, ()))
+
+        for path_from in candidates:
+            score = _similarity(sketches[path_from], sketch_to)
+
+            if score >= RENAME_THRESHOLD:
+                is_rename = path_from in deleted
+                pairs.append((score, is_rename, path_from, path_to))
+
+    renames = {}
+    used_sources = set()
+
+    for score, is_rename, path_from, path_to in sorted(pairs, reverse=True):
+        if path_to in renames or (is_rename and path_from in used_sources):
+            continue
+
+        if is_rename:
+            used_sources.add(path_from)
+
+        action = "renamed" if is_rename else "copied"
+        renames[path_to] = Rename(path_from, path_to, action, score)
+
+    return renames
+
+
+def get_sketch(object_id: str) -> Sketch:
+    repository = data.get_repository()
+    sketch = repository.get_cached_sketch(object_id)
+    trace.cache_lookup("sketch", sketch is not None)
+
+    if sketch is None:
+        sketch = _create_sketch(repository.get_object(object_id))
+        repository.cache_sketch(object_id, sketch, len(sketch.chunks) + 1)
+
+    return sketch
+
+
+def _create_sketch(content: bytes) -> Sketch:
+    chunks = Counter()
+
+    for line in content.splitlines(keepends=True):
+        for start in range(0, len(line), CHUNK_SIZE):
+            chunk = line[start:start + CHUNK_SIZE]
+            chunks[zlib.crc32(chunk)] += len(chunk)
+
+    if not chunks:
+        return Sketch(size=0, chunks=chunks, signature=())
+
+    signature = tuple(min((a * chunk + b) % _MERSENNE_PRIME for chunk in chunks)
+                      for a, b in _SIGNATURE_SEEDS)
+
+    return Sketch(size=len(content), chunks=chunks, signature=signature)
+
+
+def _iter_signature_bands(sketch: Sketch) -> Iterator[Tuple[int, ...]]:
+    if not sketch.signature:
+        return
+
+    rows = SIGNATURE_SIZE // SIGNATURE_BANDS
+
+    for band in range(SIGNATURE_BANDS):
+        yield (band, *sketch.signature[band * rows:(band + 1) * rows])
+
+
+def _similarity(sketch_from: Sketch, sketch_to: Sketch) -> float:
+    max_size = max(sketch_from.size, sketch_to.size)
+
+    if not max_size or min(sketch_from.size, sketch_to.size) < max_size * RENAME_THRESHOLD:
+        return 0.0
+
+    common = sum(min(size, sketch_to.chunks[chunk])
+                 for chunk, size in sketch_from.chunks.items()
+                 if chunk in sketch_to.chunks)
+
+    return common / max_size
@@ -0,0 +1,159 @@
+from collections import namedtuple
+import itertools
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import zlib
+
+from . import chunking
+from . import data
+from . import workers
+from .repository import Repository
+
+BATCH_SIZE = 256
+
+ObjectCheck = namedtuple(
+    "ObjectCheck", ["object_id", "fmt", "error", "references"])
+Report = namedtuple(
+    "Report", ["checked", "corrupt", "missing", "bad_types", "dangling", "store_errors"])
+
+
+def fsck(reachable_only: bool = False, jobs: int = None, progress: Callable[[int, Optional[int]], None] = None) -> Report:
+    repository = data.get_repository()
+    roots = _get_roots()
+    checks: Dict[str, ObjectCheck] = {}
+
+    with workers.batch_pool(repository, jobs) as map_batches:
+        if reachable_only:
+            frontier = {object_id: None for object_id in roots}
+
+            while frontier:
+                for check in _check_objects(map_batches, frontier, checks, progress):
+                    checks[check.object_id] = check
+
+                next_frontier = {}
+
+                for object_id in frontier:
+                    for _, reference in checks[object_id].references:
+                        if reference not in checks:
+                            next_frontier[reference] = None
+
+                frontier = next_frontier
+        else:
+            object_ids = list(repository.object_store.iter_object_ids())
+
+            for check in _check_objects(map_batches, object_ids, checks, progress):
+                checks[check.object_id] = check
+
+    referenced: Set[str] = set()
+    missing = []
+    bad_types = []
+
+    for object_id, check in sorted(checks.items()):
+        for fmt, reference in check.references:
+            referenced.add(reference)
+            target = checks.get(reference)
+
+            if target is None or target.error == "missing":
+                missing.append((fmt, reference, object_id))
+            elif target.fmt and target.fmt != fmt and (fmt, target.fmt) != ("blob", "chunked"):
+                bad_types.append((reference, fmt, target.fmt, object_id))
+
+    corrupt = {object_id: check.error for object_id, check in sorted(checks.items())
+               if check.error and check.error != "missing"}
+
+    missing_ids = {object_id for _, object_id, _ in missing}
+
+    for object_id in sorted(roots - missing_ids):
+        if object_id not in checks or checks[object_id].error == "missing":
+            missing.append((None, object_id, None))
+
+    dangling = []
+
+    if not reachable_only:
+        dangling = [(check.fmt, object_id) for object_id, check in sorted(checks.items())
+                    if not check.error and object_id not in referenced and object_id not in roots]
+
+    return Report(
+        checked=sum(check.error != "missing" for check in checks.values()),
+        corrupt=corrupt,
+        missing=sorted(set(missing), key=lambda entry: entry[1]),
+        bad_types=bad_types,
+        dangling=dangling,
+        store_errors=repository.object_store.verify(),
+    )
+
+
+def _get_roots() -> Set[str]:
+    roots = {ref.value for _, ref in data.iter_refs()}
+    roots.update(data.read_index().values())
+
+    return roots
+
+
+def _check_objects(map_batches, object_ids: Iterable[str], checks: Dict[str, ObjectCheck], progress) -> Iterator[ObjectCheck]:
+    object_ids = [object_id for object_id in object_ids if object_id not in checks]
+    total = len(checks) + len(object_ids)
+    done = len(checks)
+    batches = [object_ids[start:start + BATCH_SIZE]
+               for start in range(0, len(object_ids), BATCH_SIZE)]
+
+    for results in map_batches(_verify_objects, batches):
+        yield from results
+        done += len(results)
+
+        if progress:
+            progress(done, total)
+
+
+def _verify_objects(repository: Repository, object_ids: List[str]) -> List[ObjectCheck]:
+    return [_verify_object(repository, object_id) for object_id in object_ids]
+
+
+def _verify_object(repository: Repository, object_id: str) -> ObjectCheck:
+    try:
+        compressed = repository.object_store.read(object_id)
+    except FileNotFoundError:
+        return ObjectCheck(object_id, None, "missing", ())
+
+    try:
+        obj = zlib.decompress(compressed)
+    except zlib.error as e:
+        return ObjectCheck(object_id, None, f"cannot decompress: {e}", ())
+
+    if repository.compute_object_id(obj) != object_id:
+        return ObjectCheck(object_id, None, "hash mismatch", ())
+
+    try:
+        fmt, content = repository._parse_object(object_id, obj)
+        references = tuple(_iter_references(fmt, content))
+    except (AssertionError, ValueError, UnicodeDecodeError) as e:
+        return ObjectCheck(object_id, None, f"malformed: {e}", ())
+
+    return ObjectCheck(object_id, fmt, None, references)
+
+
+def _iter_references(fmt: str, content: bytes) -> Iterator[Tuple[str, str]]:
+    if fmt == "tree":
+        for entry in content.decode().splitlines():
+            entry_fmt, object_id, _ = entry.split(" ", 2)
+            yield entry_fmt, object_id
+    elif fmt == "commit":
+        lines = content.decode().splitlines()
+
+        for line in itertools.takewhile(bool, lines):
+            key, value = line.split(" ", 1)
+
+            if key == "tree":
+                yield "tree", value
+            elif key == "parent":
+                yield "commit", value
+    elif fmt == "chunked":
+        for object_id, _ in chunking.parse_manifest(content):
+            yield "chunk", object_id
+    elif fmt not in ("blob", "chunk"):
+        raise ValueError(f"unknown object type {fmt}")
+
+
+def print_progress(done: int, total: Optional[int]):
+    print(f"\rChecking objects: {done}/{total} ({done * 100 // max(total, 1)}%)",
+          end="", file=sys.stderr, flush=True)
@@ -0,0 +1,138 @@
+from collections import defaultdict, namedtuple
+import json
+from typing import Dict, Iterable, Iterator, List, Set, TextIO, Tuple
+
+GraphRow = namedtuple(
+    "GraphRow", ["edges_before", "commit", "padding", "edges_after"])
+GraphNode = namedtuple("GraphNode", ["object_id", "boundary"])
+GraphEdge = namedtuple("GraphEdge", ["child", "parent", "skipped"])
+
+EXPORT_FORMATS = ("dot", "json")
+
+
+def iter_graph_rows(commits: Iterable[Tuple[str, List[str]]]) -> Iterator[GraphRow]:
+    columns: List[str] = []
+
+    for object_id, parents in commits:
+        if object_id not in columns:
+            columns.append(object_id)
+
+        edges_before = []
+        column = columns.index(object_id)
+        duplicates = [index for index, value in enumerate(columns)
+                      if value == object_id and index != column]
+
+        if duplicates:
+            edges_before.append(_render(
+                ["/" if index in duplicates else "|" for index in range(len(columns))]))
+            columns = [value for index, value in enumerate(columns)
+                       if index not in duplicates]
+
+        commit = _render(["*" if index == column else "|"
+                          for index in range(len(columns))])
+
+        columns[column:column + 1] = parents
+        edges_after = []
+
+        if len(parents) > 1:
+            edges_after.append(_render(
+                ["|"] * (column + 1) + ["\\"] * (len(columns) - column - 1)))
+
+        yield GraphRow(edges_before, commit, _render(["|"] * len(columns)), edges_after)
+
+
+def _render(marks: List[str]) -> str:
+    return " ".join(marks) + " " if marks else ""
+
+
+def iter_graph_elements(commits: Iterable[Tuple[str, List[str]]], keep: Set[str] = (), simplify: bool = False) -> Iterator[Tuple]:
+    incoming: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+
+    for object_id, parents in commits:
+        edges = incoming.pop(object_id, [])
+
+        if simplify and len(edges) == 1 and len(parents) == 1 and object_id not in keep:
+            child, skipped = edges[0]
+            incoming[parents[0]].append((child, skipped + 1))
+            continue
+
+        yield GraphNode(object_id, boundary=False)
+
+        for child, skipped in edges:
+            yield GraphEdge(child, object_id, skipped)
+
+        for parent in parents:
+            incoming[parent].append((object_id, 0))
+
+    for object_id, edges in incoming.items():
+        yield GraphNode(object_id, boundary=True)
+
+        for child, skipped in edges:
+            yield GraphEdge(child, object_id, skipped)
+
+
+def write_dot(file: TextIO, refs: Iterable[Tuple[str, str]], elements: Iterable[Tuple]):
+    file.write("digraph commits {\n")
+    refs = list(refs)
+    targets = {target for _, target in refs}
+    shown = set()
+
+    for element in elements:
+        if isinstance(element, GraphNode):
+            style = "dashed" if element.boundary else "filled"
+            file.write(
+                f'"{element.object_id}" [shape=box style={style} label="{element.object_id[:10]}"]\n')
+
+            if element.object_id in targets:
+                shown.add(element.object_id)
+        elif element.skipped:
+            file.write(
+                f'"{element.child}" -> "{element.parent}" [style=dashed label="{element.skipped} commits"]\n')
+        else:
+            file.write(f'"{element.child}" -> "{element.parent}"\n')
+
+    for refname, target in _iter_shown_refs(refs, shown):
+        file.write(f'"{refname}" [shape=note]\n')
+        file.write(f'"{refname}" -> "{target}"\n')
+
+    file.write("}\n")
+
+
+def write_json(file: TextIO, refs: Iterable[Tuple[str, str]], elements: Iterable[Tuple]):
+    refs = list(refs)
+    targets = {target for _, target in refs}
+    shown = set()
+
+    for element in elements:
+        if isinstance(element, GraphNode):
+            _write_json_line(file, {"type": "commit", "id": element.object_id,
+                                    "boundary": element.boundary})
+
+            if element.object_id in targets:
+                shown.add(element.object_id)
+        else:
+            _write_json_line(file, {"type": "edge", "child": element.child,
+                                    "parent": element.parent, "skipped": element.skipped})
+
+    for refname, target in _iter_shown_refs(refs, shown):
+        _write_json_line(
+            file, {"type": "ref", "name": refname, "target": target})
+
+
+def _iter_shown_refs(refs: List[Tuple[str, str]], shown: Set[str]) -> Iterator[Tuple[str, str]]:
+    pending = refs
+
+    while pending:
+        found = [ref for ref in pending if ref[1] in shown]
+
+        if not found:
+            return
+
+        yield from found
+        shown.update(refname for refname, _ in found)
+        pending = [ref for ref in pending if ref not in found]
+
+
+def _write_json_line(file: TextIO, value: dict):
+    file.write(json.dumps(value))
+    file.write("\n")
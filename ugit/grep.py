@@ -0,0 +1,86 @@
+from collections import defaultdict, namedtuple
+import os
+import re
+from typing import Dict, Iterator, List, Tuple
+
+from . import base
+from . import data
+from . import workers
+from .repository import Repository
+
+BINARY_CHECK_SIZE = 8000
+BATCH_SIZE = 64
+
+GrepMatch = namedtuple("GrepMatch", ["path", "line_number", "line"])
+
+
+def grep(pattern: str, object_id: str, paths: List[str] = (), ignore_case: bool = False, jobs: int = None) -> Iterator[GrepMatch]:
+    paths = [_normalize_path(path) for path in paths]
+    entries = sorted(_iter_blobs(base.get_commit(object_id).tree, paths))
+
+    paths_by_blob: Dict[str, List[str]] = defaultdict(list)
+    for path, blob_id in entries:
+        paths_by_blob[blob_id].append(path)
+
+    blob_ids = list(paths_by_blob)
+    flags = re.IGNORECASE if ignore_case else 0
+    batches = [(pattern, flags, blob_ids[start:start + BATCH_SIZE])
+               for start in range(0, len(blob_ids), BATCH_SIZE)]
+
+    results = {}
+    next_entry = 0
+
+    with workers.batch_pool(data.get_repository(), jobs) as map_batches:
+        for batch_results in map_batches(_search_blobs, batches):
+            results.update(batch_results)
+
+            while next_entry < len(entries) and entries[next_entry][1] in results:
+                path, blob_id = entries[next_entry]
+                next_entry += 1
+
+                for line_number, line in results[blob_id]:
+                    yield GrepMatch(path, line_number, line)
+
+
+def _iter_blobs(tree_id: str, paths: List[str], base_path: str = "") -> Iterator[Tuple[str, str]]:
+    for fmt, object_id, name in base._iter_tree_entries(tree_id):
+        path = base_path + name
+
+        if fmt == "tree":
+            if _is_path_selected(path, paths, is_tree=True):
+                yield from _iter_blobs(object_id, paths, f"{path}/")
+        elif _is_path_selected(path, paths):
+            yield path, object_id
+
+
+def _is_path_selected(path: str, paths: List[str], is_tree: bool = False) -> bool:
+    if not paths or "." in paths:
+        return True
+
+    return any(path == selected or path.startswith(f"{selected}/")
+               or (is_tree and selected.startswith(f"{path}/"))
+               for selected in paths)
+
+
+def _normalize_path(path: str) -> str:
+    return os.path.normpath(path).strip("/") or "."
+
+
+def _search_blobs(repository: Repository, batch: Tuple[str, int, List[str]]) -> Dict[str, List[Tuple[int, str]]]:
+    pattern, flags, blob_ids = batch
+    regex = re.compile(pattern.encode(), flags)
+    results = {}
+
+    for blob_id in blob_ids:
+        content = repository.get_object(blob_id)
+        matches = []
+
+        if b"\x00" not in content[:BINARY_CHECK_SIZE]:
+            for line_number, line in enumerate(content.splitlines(), start=1):
+                if regex.search(line):
+                    matches.append(
+                        (line_number, line.decode(errors="replace")))
+
+        results[blob_id] = matches
+
+    return results
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+import os
+import random
+import time
+from typing import Dict, Iterable, Iterator, List
+
+from . import trace
+
+LOCK_SUFFIX = ".lock"
+LOCK_TIMEOUT = 10.0
+RETRY_DELAY = 0.001
+MAX_RETRY_DELAY = 0.1
+
+
+class LockError(Exception):
+    pass
+
+
+@contextmanager
+def lock(paths: Iterable[str], timeout: float = LOCK_TIMEOUT) -> Iterator[Dict[str, int]]:
+    locks: Dict[str, int] = {}
+
+    try:
+        acquire(locks, paths, timeout)
+
+        yield locks
+    finally:
+        for path, fd in locks.items():
+            os.close(fd)
+            os.remove(path + LOCK_SUFFIX)
+
+
+def acquire(locks: Dict[str, int], paths: Iterable[str], timeout: float = LOCK_TIMEOUT):
+    for path in sorted(set(paths) - set(locks)):
+        locks[path] = _acquire(path, timeout)
+
+
+def commit(locks: Dict[str, int], contents: Dict[str, bytes], fsync: bool = True, removed: List[str] = ()):
+    for path in removed:
+        assert path in locks, f"{path} is not locked"
+
+    for path, content in contents.items():
+        fd = locks[path]
+        view = memoryview(content)
+
+        while view:
+            view = view[os.write(fd, view):]
+
+        if fsync:
+            os.fsync(fd)
+
+    for path in contents:
+        os.close(locks.pop(path))
+        os.replace(path + LOCK_SUFFIX, path)
+
+    for path in removed:
+        if os.path.exists(path):
+            os.remove(path)
+
+    if fsync:
+        for dirname in {os.path.dirname(path) for path in contents}:
+            fd = os.open(dirname, os.O_RDONLY)
+
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+def is_lock_file(path: str) -> bool:
+    return path.endswith(LOCK_SUFFIX)
+
+
+def _acquire(path: str, timeout: float) -> int:
+    lock_path = path + LOCK_SUFFIX
+    deadline = time.monotonic() + timeout
+    delay = RETRY_DELAY
+
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    while True:
+        try:
+            return os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            trace.count("locks.retries")
+
+            if time.monotonic() >= deadline:
+                raise LockError(f"Unable to lock {path}: {lock_path} exists")
+
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, MAX_RETRY_DELAY)
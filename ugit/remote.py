@@ -3,30 +3,49 @@ import os
 from typing import Dict
 from . import data
 from . import base
+from . import trace
+from .repository import Repository
 
 REMOTE_REFS_BASE = 'refs/heads/'
 LOCAL_REFS_BASE = 'refs/remote/'
 
 
 def fetch(remote_path: str):
-    refs = _get_remote_refs(remote_path, REMOTE_REFS_BASE)
+    remote_repository = data.open_repository(remote_path)
+    _assert_same_object_format(remote_repository)
+    refs = _get_remote_refs(remote_repository, REMOTE_REFS_BASE)
 
-    for object_id in base.iter_objects_in_commits(refs.values()):
-        data.fetch_object_if_missing(object_id, remote_path)
+    if remote_repository.has_chunked_objects:
+        data.get_repository().mark_chunked_objects()
 
-    for remote_name, value in refs.items():
-        refname = os.path.relpath(remote_name, REMOTE_REFS_BASE)
-        data.update_ref(os.path.join(LOCAL_REFS_BASE, refname),
-                        data.RefValue(symbolic=False, value=value))
+    with trace.phase("fetch_objects"), data.get_object_store().transaction():
+        for object_id in base.iter_objects_in_commits(refs.values()):
+            data.fetch_object_if_missing(object_id, remote_repository)
 
+    base.write_commit_graph(refs.values())
 
-def _get_remote_refs(remote_path: str, prefix: str = '') -> Dict[str, str]:
-    with data.change_git_dir(remote_path):
-        return {refname: ref.value for refname, ref in data.iter_refs(prefix)}
+    data.update_refs([
+        data.RefUpdate(os.path.join(LOCAL_REFS_BASE, os.path.relpath(remote_name, REMOTE_REFS_BASE)),
+                       data.RefValue(symbolic=False, value=value))
+        for remote_name, value in refs.items()
+    ])
+
+
+def _assert_same_object_format(remote_repository: Repository):
+    local_format = data.get_repository().object_format
+    remote_format = remote_repository.object_format
+
+    assert local_format == remote_format, f"Object format mismatch: local {local_format}, remote {remote_format}"
+
+
+def _get_remote_refs(remote_repository: Repository, prefix: str = '') -> Dict[str, str]:
+    return {refname: ref.value for refname, ref in remote_repository.iter_refs(prefix)}
 
 
 def push(remote_path: str, refname: str):
-    remote_refs = _get_remote_refs(remote_path)
+    remote_repository = data.open_repository(remote_path)
+    _assert_same_object_format(remote_repository)
+    remote_refs = _get_remote_refs(remote_repository)
     remote_ref = remote_refs.get(refname)
     local_ref = data.get_ref(refname).value
 
@@ -38,9 +57,15 @@ def push(remote_path: str, refname: str):
     local_objects = set(base.iter_objects_in_commits({local_ref}))
     objects_to_push = local_objects - remote_objects
 
-    for object_id in objects_to_push:
-        data.push_object(object_id, remote_path)
+    if data.get_repository().has_chunked_objects:
+        remote_repository.mark_chunked_objects()
+
+    with trace.phase("push_objects"), remote_repository.object_store.transaction():
+        for object_id in objects_to_push:
+            data.push_object(object_id, remote_repository)
+
+    with data.use_repository(remote_repository):
+        base.write_commit_graph([local_ref])
 
-    with data.change_git_dir(remote_path):
-        data.update_ref(refname, data.RefValue(
-            symbolic=False, value=local_ref))
+    remote_repository.update_ref(refname, data.RefValue(symbolic=False, value=local_ref),
+                                 expected=data.RefValue(symbolic=False, value=remote_ref))
@@ -0,0 +1,606 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import contextvars
+import hashlib
+import json
+import os
+import stat
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+import zlib
+
+from . import chunking
+from . import commitgraph
+from . import lockfile
+from . import storage
+from . import trace
+
+OBJECT_CACHE_SIZE = 64 * 1024 * 1024
+OBJECT_CACHE_MAX_ENTRY = 1024 * 1024
+SKETCH_CACHE_SIZE = 2 * 1024 * 1024
+FORMAT_CACHE_SIZE = 64 * 1024
+STAT_GRANULARITY_NS = 2 * 1000 * 1000 * 1000
+
+OBJECT_FORMATS = {
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": lambda data=b"": hashlib.blake2b(data, digest_size=32),
+}
+
+RefValue = namedtuple("RefValue", ["symbolic", "value"])
+RefUpdate = namedtuple("RefUpdate", ["ref", "new", "expected", "deref"],
+                       defaults=(None, True))
+WriteBatch = namedtuple("WriteBatch", ["pending", "executor"])
+
+
+class RefConflict(Exception):
+    pass
+
+
+def _stat_key(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _is_racy(key: Tuple[int, int, int], checked_at: int) -> bool:
+    return key[0] >= checked_at - STAT_GRANULARITY_NS
+
+
+def _format_ref(refValue: RefValue) -> str:
+    if refValue.symbolic:
+        return f"ref: {refValue.value}"
+
+    return refValue.value
+
+
+class Repository:
+    def __init__(self, path: str = "."):
+        self.worktree = os.path.abspath(path)
+        self.git_dir = os.path.join(self.worktree, ".ugit")
+
+        self._lock = threading.RLock()
+        self._object_store = None
+        self._object_format = None
+        self._chunk_threshold = None
+        self._has_chunked_objects = None
+        self._object_cache = OrderedDict()
+        self._object_cache_bytes = 0
+        self._format_cache = OrderedDict()
+        self._sketch_cache = OrderedDict()
+        self._sketch_cache_weight = 0
+        self._ref_cache = {}
+        self._file_cache = {}
+        self._write_batch = contextvars.ContextVar("write_batch", default=None)
+        self._commit_graph_store = None
+        self._local = threading.local()
+
+    def init(self, object_store: str = "loose", chunk_threshold: int = None, object_format: str = "sha1"):
+        assert object_store in storage.OBJECT_STORES, f"Unknown object store {object_store}"
+        assert object_format in OBJECT_FORMATS, f"Unknown object format {object_format}"
+
+        os.makedirs(self.git_dir)
+
+        if object_store == "loose":
+            os.makedirs(os.path.join(self.git_dir, "objects"))
+
+        config = {"objectStore": object_store, "objectFormat": object_format}
+
+        if chunk_threshold:
+            config["chunkThreshold"] = chunk_threshold
+
+        self._dump_json("config", config)
+
+    def get_config(self) -> dict:
+        return self._load_json("config")
+
+    @property
+    def object_format(self) -> str:
+        if self._object_format is None:
+            self._object_format = self.get_config().get("objectFormat", "sha1")
+
+            assert self._object_format in OBJECT_FORMATS, f"Unknown object format {self._object_format}"
+
+        return self._object_format
+
+    @property
+    def chunk_threshold(self) -> int:
+        if self._chunk_threshold is None:
+            self._chunk_threshold = self.get_config().get("chunkThreshold") or 0
+
+        return self._chunk_threshold
+
+    @property
+    def has_chunked_objects(self) -> bool:
+        if self._has_chunked_objects is None:
+            self._has_chunked_objects = bool(
+                self.chunk_threshold or self.get_config().get("chunkedObjects"))
+
+        return self._has_chunked_objects
+
+    def mark_chunked_objects(self):
+        if self.has_chunked_objects:
+            return
+
+        path = os.path.join(self.git_dir, "config")
+
+        with lockfile.lock([path]) as locks:
+            config = dict(self.get_config())
+            config["chunkedObjects"] = True
+            self._dump_json("config", config, locks)
+
+        self._has_chunked_objects = True
+
+    @property
+    def object_id_length(self) -> int:
+        return OBJECT_FORMATS[self.object_format]().digest_size * 2
+
+    def compute_object_id(self, obj: bytes) -> str:
+        return OBJECT_FORMATS[self.object_format](obj).hexdigest()
+
+    @property
+    def object_store(self) -> storage.ObjectStore:
+        with self._lock:
+            if self._object_store is None:
+                store_type = self.get_config().get("objectStore", "loose")
+                self._object_store = storage.OBJECT_STORES[store_type](
+                    self.git_dir)
+
+        return self._object_store
+
+    @property
+    def commit_graph_store(self) -> commitgraph.CommitGraphStore:
+        with self._lock:
+            if self._commit_graph_store is None:
+                self._commit_graph_store = commitgraph.CommitGraphStore(
+                    self.git_dir)
+
+        return self._commit_graph_store
+
+    def close(self):
+        with self._lock:
+            if self._object_store is not None:
+                self._object_store.close()
+                self._object_store = None
+
+            if self._commit_graph_store is not None:
+                self._commit_graph_store.close()
+                self._commit_graph_store = None
+
+    @contextmanager
+    def write_batch(self, fsync: bool = None, background: bool = True):
+        if self._write_batch.get() is not None:
+            yield
+            return
+
+        if fsync is None:
+            fsync = self.get_config().get("fsyncObjects", True)
+
+        executor = ThreadPoolExecutor(max_workers=1) if background else None
+        token = self._write_batch.set(
+            WriteBatch(pending={}, executor=executor))
+
+        try:
+            yield
+
+            store = self.object_store
+
+            with trace.phase("write_batch"), store.transaction(fsync=fsync):
+                for object_id in self._write_batch.get().pending:
+                    store.write(object_id, self._read_compressed(object_id))
+        finally:
+            self._write_batch.reset(token)
+
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    def _read_compressed(self, object_id: str) -> bytes:
+        batch = self._write_batch.get()
+
+        if batch is not None and object_id in batch.pending:
+            compressed = batch.pending[object_id]
+
+            if isinstance(compressed, Future):
+                return compressed.result()
+
+            return compressed
+
+        return self.object_store.read(object_id)
+
+    def hash_object(self, raw_file: bytes, fmt: str = "blob") -> str:
+        if fmt == "blob" and self.chunk_threshold and len(raw_file) > self.chunk_threshold:
+            return self._hash_chunked(raw_file)
+
+        obj = fmt.encode() + b' ' + str(len(raw_file)).encode() + b'\x00' + raw_file
+        object_id = self.compute_object_id(obj)
+
+        if self.object_exists(object_id):
+            trace.count("objects.deduplicated")
+            return object_id
+
+        trace.count("objects.written")
+        trace.count("bytes.compressed", len(obj))
+
+        batch = self._write_batch.get()
+
+        if batch is None:
+            self.object_store.write(object_id, zlib.compress(obj))
+        elif batch.executor:
+            batch.pending[object_id] = batch.executor.submit(
+                zlib.compress, obj)
+        else:
+            batch.pending[object_id] = zlib.compress(obj)
+
+        return object_id
+
+    def hash_file(self, path: str, file_hashes: dict) -> str:
+        relpath = os.path.relpath(path, self.worktree)
+        checked_at = time.time_ns()
+        key = _stat_key(path)
+        entry = file_hashes.get(relpath)
+        hit = key is not None and entry is not None and tuple(entry[:3]) == key
+
+        trace.cache_lookup("file_hash", hit)
+
+        if hit and self.object_exists(entry[3]):
+            return entry[3]
+
+        with open(path, "rb") as f:
+            object_id = self.hash_object(f.read())
+
+        if key is not None and not _is_racy(key, checked_at) and _stat_key(path) == key:
+            file_hashes[relpath] = [*key, object_id]
+        else:
+            file_hashes.pop(relpath, None)
+
+        return object_id
+
+    def _hash_chunked(self, raw_file: bytes) -> str:
+        with self.write_batch():
+            chunks = [(self.hash_object(chunk, "chunk"), len(chunk))
+                      for chunk in chunking.iter_chunks(raw_file)]
+
+            return self.hash_object(chunking.create_manifest(chunks), "chunked")
+
+    def get_object(self, object_id: str, expected: str = "blob") -> bytes:
+        fmt, content = self._get_parsed_object(object_id)
+
+        if fmt == "chunked" and expected != "chunked":
+            fmt, content = "blob", b"".join(self.iter_blob_chunks(object_id))
+
+        if expected is not None:
+            assert fmt == expected, f"Expected {expected}, got {fmt}"
+
+        return content
+
+    def iter_blob_chunks(self, object_id: str) -> Iterator[bytes]:
+        fmt, content = self._get_parsed_object(object_id)
+
+        if fmt != "chunked":
+            assert fmt == "blob", f"Expected blob, got {fmt}"
+            yield content
+            return
+
+        for chunk_id, _ in chunking.parse_manifest(content):
+            yield self.get_object(chunk_id, "chunk")
+
+    def get_chunk_ids(self, object_id: str) -> List[str]:
+        if not self.has_chunked_objects or self.get_object_format(object_id) != "chunked":
+            return []
+
+        manifest = self.get_object(object_id, "chunked")
+
+        return [chunk_id for chunk_id, _ in chunking.parse_manifest(manifest)]
+
+    def get_object_format(self, object_id: str) -> str:
+        with self._lock:
+            fmt = self._format_cache.get(object_id)
+
+            if fmt is not None:
+                self._format_cache.move_to_end(object_id)
+
+        if fmt is None:
+            batch = self._write_batch.get()
+
+            if batch is not None and object_id in batch.pending:
+                prefix = self._read_compressed(object_id)
+            else:
+                prefix = self.object_store.read_prefix(object_id, 256)
+
+            header = zlib.decompressobj().decompress(prefix, 64)
+
+            if b" " not in header:
+                header = zlib.decompress(self._read_compressed(object_id))
+
+            fmt = header[:header.index(b" ")].decode("ascii")
+
+            with self._lock:
+                self._format_cache[object_id] = fmt
+
+                if len(self._format_cache) > FORMAT_CACHE_SIZE:
+                    self._format_cache.popitem(last=False)
+
+        return fmt
+
+    def _get_parsed_object(self, object_id: str) -> Tuple[str, bytes]:
+        with self._lock:
+            cached = self._object_cache.get(object_id)
+
+            if cached is not None:
+                self._object_cache.move_to_end(object_id)
+
+        trace.cache_lookup("object", cached is not None)
+
+        if cached is None:
+            obj = zlib.decompress(self._read_compressed(object_id))
+            trace.count("objects.read")
+            trace.count("bytes.decompressed", len(obj))
+
+            cached = self._parse_object(object_id, obj)
+            self._cache_object(object_id, cached)
+
+        return cached
+
+    def _parse_object(self, object_id: str, obj: bytes) -> Tuple[str, bytes]:
+        space_index = obj.find(b' ')
+        fmt = obj[0:space_index].decode("ascii")
+
+        null_index = obj.find(b'\x00', space_index)
+        size = int(obj[space_index:null_index].decode("ascii"))
+
+        content = obj[null_index + 1:]
+
+        assert size == len(content), f"bad length for object: {object_id}"
+
+        return fmt, content
+
+    def _cache_object(self, object_id: str, cached: Tuple[str, bytes]):
+        size = len(cached[1])
+
+        if size > OBJECT_CACHE_MAX_ENTRY:
+            return
+
+        with self._lock:
+            if object_id in self._object_cache:
+                return
+
+            self._object_cache[object_id] = cached
+            self._object_cache_bytes += size
+
+            while self._object_cache_bytes > OBJECT_CACHE_SIZE:
+                _, (_, evicted) = self._object_cache.popitem(last=False)
+                self._object_cache_bytes -= len(evicted)
+
+    def get_cached_sketch(self, object_id: str) -> Optional[tuple]:
+        with self._lock:
+            cached = self._sketch_cache.get(object_id)
+
+            if cached is None:
+                return None
+
+            self._sketch_cache.move_to_end(object_id)
+
+        return cached[0]
+
+    def cache_sketch(self, object_id: str, sketch: tuple, weight: int):
+        with self._lock:
+            if object_id in self._sketch_cache:
+                return
+
+            self._sketch_cache[object_id] = (sketch, weight)
+            self._sketch_cache_weight += weight
+
+            while self._sketch_cache_weight > SKETCH_CACHE_SIZE and len(self._sketch_cache) > 1:
+                _, (_, evicted) = self._sketch_cache.popitem(last=False)
+                self._sketch_cache_weight -= evicted
+
+    def object_exists(self, object_id: str) -> bool:
+        batch = self._write_batch.get()
+
+        if batch is not None and object_id in batch.pending:
+            return True
+
+        return self.object_store.exists(object_id)
+
+    def fetch_object_if_missing(self, object_id: str, remote: "Repository"):
+        if self.object_exists(object_id):
+            return
+
+        trace.count("objects.fetched")
+        self.object_store.write(object_id, remote._read_compressed(object_id))
+
+    def push_object(self, object_id: str, remote: "Repository"):
+        trace.count("objects.pushed")
+        remote.object_store.write(object_id, self._read_compressed(object_id))
+
+    def update_ref(self, ref: str, refValue: RefValue, deref: bool = True, expected: RefValue = None):
+        assert refValue.value
+
+        self.update_refs([RefUpdate(ref, refValue, expected, deref)])
+
+    def update_refs(self, updates: List[RefUpdate]):
+        requested = [os.path.join(self.git_dir, update.ref)
+                     for update in updates]
+
+        with trace.phase("update_refs"), lockfile.lock(requested) as locks:
+            updates = [update._replace(ref=self._get_ref_internal(update.ref, update.deref)[0])
+                       for update in updates]
+            paths = {update.ref: os.path.join(self.git_dir, update.ref)
+                     for update in updates}
+            lockfile.acquire(locks, paths.values())
+
+            for update in updates:
+                if update.expected is None:
+                    continue
+
+                current = self._get_ref_internal(update.ref, deref=False)[1]
+
+                if current != update.expected:
+                    raise RefConflict(
+                        f"Ref {update.ref} changed: expected {update.expected.value}, found {current.value}")
+
+            contents = {paths[update.ref]: _format_ref(update.new).encode()
+                        for update in updates if update.new is not None}
+            removed = [paths[update.ref]
+                       for update in updates if update.new is None]
+
+            lockfile.commit(locks, contents, self._fsync_refs(), removed)
+
+        with self._lock:
+            for update in updates:
+                self._ref_cache.pop(update.ref, None)
+
+    def _fsync_refs(self) -> bool:
+        return self.get_config().get("fsyncRefs", True)
+
+    def get_ref(self, ref: str, deref=True) -> RefValue:
+        return self._get_ref_internal(ref, deref)[1]
+
+    def _get_ref_internal(self, ref: str, deref) -> Tuple[str, RefValue]:
+        value = self._read_ref_file(ref)
+
+        symbolic = bool(value) and value.startswith("ref:")
+
+        if symbolic:
+            value = value.split(":", 1)[1].strip()
+
+            if deref:
+                return self._get_ref_internal(value, deref)
+
+        return ref, RefValue(symbolic=symbolic, value=value)
+
+    def _read_ref_file(self, ref: str) -> Optional[str]:
+        ref_path = os.path.join(self.git_dir, ref)
+        checked_at = time.time_ns()
+        key = _stat_key(ref_path)
+
+        if key is None:
+            return None
+
+        trace.count("refs.read")
+
+        with self._lock:
+            cached = self._ref_cache.get(ref)
+
+        trace.cache_lookup("ref", bool(cached and cached[0] == key))
+
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with open(ref_path, "r") as f:
+            value = f.read().strip()
+
+        if not _is_racy(key, checked_at):
+            with self._lock:
+                self._ref_cache[ref] = (key, value)
+
+        return value
+
+    def iter_refs(self, prefix: str = "", deref: bool = True) -> Iterator[Tuple[str, RefValue]]:
+        refs = ["HEAD", "MERGE_HEAD"]
+
+        for root, _, filenames in os.walk(os.path.join(self.git_dir, "refs")):
+            root = os.path.relpath(root, self.git_dir)
+            refs.extend(os.path.join(root, name) for name in filenames
+                        if not lockfile.is_lock_file(name))
+
+        for refname in refs:
+            if not refname.startswith(prefix):
+                continue
+            ref = self.get_ref(refname, deref=deref)
+
+            if ref.value:
+                yield refname, ref
+
+    def delete_ref(self, ref: str, defer=True, expected: RefValue = None):
+        self.update_refs([RefUpdate(ref, None, expected, defer)])
+
+    @contextmanager
+    def get_index(self):
+        with lockfile.lock([os.path.join(self.git_dir, "index")]) as locks:
+            cached = self._load_json("index")
+            index = dict(cached)
+
+            yield index
+
+            if index != cached:
+                self._dump_json("index", index, locks)
+
+    def read_index(self) -> dict:
+        return dict(self._load_json("index"))
+
+    @contextmanager
+    def get_file_hashes(self):
+        cached = self._load_json("file-hashes")
+        file_hashes = dict(cached)
+
+        yield file_hashes
+
+        if file_hashes != cached:
+            self._dump_json("file-hashes", file_hashes)
+
+    @contextmanager
+    def get_commit_graph(self):
+        commit_graph = getattr(self._local, "commit_graph", None)
+        owner = commit_graph is None
+
+        if owner:
+            commit_graph = commitgraph.CommitGraph(self.commit_graph_store)
+            self._local.commit_graph = commit_graph
+
+        try:
+            yield commit_graph
+        finally:
+            if owner:
+                self._local.commit_graph = None
+
+            commit_graph.flush()
+
+    def _load_json(self, name: str) -> dict:
+        path = os.path.join(self.git_dir, name)
+        checked_at = time.time_ns()
+        key = _stat_key(path)
+
+        if key is None:
+            return {}
+
+        trace.count(f"{name}.loads")
+
+        with self._lock:
+            cached = self._file_cache.get(name)
+
+        trace.cache_lookup(name, bool(cached and cached[0] == key))
+
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with open(path) as f:
+            value = json.load(f)
+
+        if not _is_racy(key, checked_at):
+            with self._lock:
+                self._file_cache[name] = (key, value)
+
+        return value
+
+    def _dump_json(self, name: str, value: dict, locks: Dict[str, int] = None):
+        path = os.path.join(self.git_dir, name)
+
+        if locks is None:
+            with lockfile.lock([path]) as locks:
+                self._dump_json(name, value, locks)
+            return
+
+        lockfile.commit(locks, {path: json.dumps(value).encode()},
+                        self._fsync_refs())
+
+        with self._lock:
+            self._file_cache.pop(name, None)
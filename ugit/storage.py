@@ -0,0 +1,283 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import contextvars
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Iterator, List
+
+
+class ObjectStore(ABC):
+    @abstractmethod
+    def exists(self, object_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def read(self, object_id: str) -> bytes:
+        pass
+
+    def read_prefix(self, object_id: str, size: int) -> bytes:
+        return self.read(object_id)[:size]
+
+    @abstractmethod
+    def write(self, object_id: str, compressed: bytes):
+        pass
+
+    @abstractmethod
+    def iter_object_ids(self) -> Iterator[str]:
+        pass
+
+    def verify(self) -> List[str]:
+        return []
+
+    @contextmanager
+    def transaction(self, fsync: bool = False):
+        yield
+
+    def close(self):
+        pass
+
+
+class LooseObjectStore(ObjectStore):
+    def __init__(self, git_dir: str):
+        self.objects_dir = os.path.join(git_dir, "objects")
+        self._pending = contextvars.ContextVar("pending", default=None)
+
+    def _path(self, object_id: str) -> str:
+        return os.path.join(self.objects_dir, object_id[:2], object_id[2:])
+
+    def exists(self, object_id: str) -> bool:
+        pending = self._pending.get()
+
+        if pending and object_id in pending:
+            return True
+
+        return os.path.isfile(self._path(object_id))
+
+    def read(self, object_id: str) -> bytes:
+        path = self._path(object_id)
+        pending = self._pending.get()
+
+        if pending and object_id in pending:
+            path = pending[object_id]
+
+        with open(path, "rb") as f:
+            return f.read()
+
+    def read_prefix(self, object_id: str, size: int) -> bytes:
+        path = self._path(object_id)
+        pending = self._pending.get()
+
+        if pending and object_id in pending:
+            path = pending[object_id]
+
+        with open(path, "rb") as f:
+            return f.read(size)
+
+    def write(self, object_id: str, compressed: bytes):
+        pending = self._pending.get()
+
+        if pending and object_id in pending:
+            return
+
+        path = self._path(object_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix="tmp_obj_")
+
+        with os.fdopen(fd, "wb") as f:
+            f.write(compressed)
+
+        if pending is not None:
+            pending[object_id] = temp_path
+        else:
+            os.replace(temp_path, path)
+
+    @contextmanager
+    def transaction(self, fsync: bool = False):
+        if self._pending.get() is not None:
+            yield
+            return
+
+        pending = {}
+        token = self._pending.set(pending)
+
+        try:
+            yield
+
+            renames = [(temp_path, self._path(object_id))
+                       for object_id, temp_path in pending.items()]
+
+            if fsync:
+                _fsync_files(temp_path for temp_path, _ in renames)
+
+            for temp_path, path in renames:
+                os.replace(temp_path, path)
+
+            if fsync:
+                _fsync_files({os.path.dirname(path) for _, path in renames})
+        finally:
+            for temp_path in pending.values():
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+            self._pending.reset(token)
+
+    def iter_object_ids(self) -> Iterator[str]:
+        if not os.path.isdir(self.objects_dir):
+            return
+
+        for prefix in sorted(os.listdir(self.objects_dir)):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+
+            for name in sorted(os.listdir(prefix_dir)):
+                if not name.startswith("tmp_obj_"):
+                    yield prefix + name
+
+    def verify(self) -> List[str]:
+        errors = []
+
+        for root, _, filenames in os.walk(self.objects_dir):
+            errors.extend(f"leftover temporary object {os.path.join(root, name)}"
+                          for name in sorted(filenames) if name.startswith("tmp_obj_"))
+
+        return errors
+
+
+class SqliteObjectStore(ObjectStore):
+    FILENAME = "objects.sqlite"
+
+    def __init__(self, git_dir: str):
+        self._lock = threading.RLock()
+        self._pending = contextvars.ContextVar("pending", default=None)
+        self._connection = sqlite3.connect(
+            os.path.join(git_dir, self.FILENAME), check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS objects "
+                "(id TEXT PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID")
+
+    def exists(self, object_id: str) -> bool:
+        pending = self._pending.get()
+
+        if pending and object_id in pending:
+            return True
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM objects WHERE id = ?", (object_id,)).fetchone()
+
+        return row is not None
+
+    def read(self, object_id: str) -> bytes:
+        pending = self._pending.get()
+
+        if pending and object_id in pending:
+            return pending[object_id]
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM objects WHERE id = ?", (object_id,)).fetchone()
+
+        if row is None:
+            raise FileNotFoundError(f"object not found: {object_id}")
+
+        return row[0]
+
+    def read_prefix(self, object_id: str, size: int) -> bytes:
+        pending = self._pending.get()
+
+        if pending and object_id in pending:
+            return pending[object_id][:size]
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT substr(data, 1, ?) FROM objects WHERE id = ?", (size, object_id)).fetchone()
+
+        if row is None:
+            raise FileNotFoundError(f"object not found: {object_id}")
+
+        return row[0]
+
+    def write(self, object_id: str, compressed: bytes):
+        pending = self._pending.get()
+
+        if pending is not None:
+            pending[object_id] = compressed
+            return
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO objects (id, data) VALUES (?, ?)",
+                    (object_id, compressed))
+
+    def iter_object_ids(self) -> Iterator[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id FROM objects ORDER BY id").fetchall()
+
+        for (object_id,) in rows:
+            yield object_id
+
+    def verify(self) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "PRAGMA integrity_check").fetchall()
+
+        return [row[0] for row in rows if row[0] != "ok"]
+
+    @contextmanager
+    def transaction(self, fsync: bool = False):
+        if self._pending.get() is not None:
+            yield
+            return
+
+        pending = {}
+        token = self._pending.set(pending)
+
+        try:
+            yield
+
+            with self._lock:
+                if fsync:
+                    self._connection.execute("PRAGMA synchronous=FULL")
+
+                with self._connection:
+                    self._connection.executemany(
+                        "INSERT OR IGNORE INTO objects (id, data) VALUES (?, ?)",
+                        pending.items())
+        finally:
+            self._pending.reset(token)
+
+            with self._lock:
+                if fsync:
+                    self._connection.execute("PRAGMA synchronous=NORMAL")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _fsync_files(paths: Iterator[str]):
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+OBJECT_STORES = {
+    "loose": LooseObjectStore,
+    "sqlite": SqliteObjectStore,
+}
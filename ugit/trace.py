@@ -0,0 +1,138 @@
+from collections import Counter
+from contextlib import nullcontext
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, TextIO
+
+ENABLED = False
+MODES = ("summary", "json")
+
+_mode = "summary"
+_lock = threading.Lock()
+_local = threading.local()
+_counters = Counter()
+_phases: Dict[str, list] = {}
+_start = None
+_NULL_PHASE = nullcontext()
+
+
+def enable(mode: str = "summary"):
+    global ENABLED, _mode, _start
+
+    assert mode in MODES, f"Unknown trace mode {mode}"
+
+    ENABLED = True
+    _mode = mode
+    _start = time.perf_counter()
+
+
+def enable_from_env():
+    value = os.environ.get("UGIT_TRACE", "")
+
+    if value and value.lower() not in ("0", "false"):
+        enable("json" if value == "json" else "summary")
+
+
+def count(name: str, amount: int = 1):
+    if not ENABLED:
+        return
+
+    with _lock:
+        _counters[name] += amount
+
+
+def cache_lookup(name: str, hit: bool):
+    if not ENABLED:
+        return
+
+    count(f"cache.{name}.{'hit' if hit else 'miss'}")
+
+
+def phase(name: str):
+    if not ENABLED:
+        return _NULL_PHASE
+
+    return _Phase(name)
+
+
+class _Phase:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+
+        if stack is None:
+            stack = _local.stack = []
+
+        self.path = "/".join([*stack[-1:], self.name])
+        stack.append(self.path)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        _local.stack.pop()
+
+        with _lock:
+            record = _phases.setdefault(self.path, [0, 0.0])
+            record[0] += 1
+            record[1] += elapsed
+
+
+def get_report() -> dict:
+    with _lock:
+        counters = dict(sorted(_counters.items()))
+        phases = {name: {"count": calls, "seconds": seconds}
+                  for name, (calls, seconds) in sorted(_phases.items())}
+
+    hit_rates = {}
+    caches = sorted({name[len("cache."):].rpartition(".")[0]
+                     for name in counters if name.startswith("cache.")})
+
+    for cache in caches:
+        hits = counters.get(f"cache.{cache}.hit", 0)
+        lookups = hits + counters.get(f"cache.{cache}.miss", 0)
+        hit_rates[cache] = {"hits": hits, "lookups": lookups,
+                            "rate": hits / lookups if lookups else 0.0}
+
+    return {
+        "seconds": time.perf_counter() - _start if _start else 0.0,
+        "phases": phases,
+        "counters": counters,
+        "cache_hit_rates": hit_rates,
+    }
+
+
+def print_report(file: TextIO = sys.stderr):
+    report = get_report()
+
+    if _mode == "json":
+        json.dump(report, file)
+        print(file=file)
+        return
+
+    print(f"ugit trace: {report['seconds'] * 1000:.2f} ms total", file=file)
+
+    if report["phases"]:
+        print("phases:", file=file)
+
+    for name, record in report["phases"].items():
+        print(f"  {name:<40} {record['count']:>6} x {record['seconds'] * 1000:10.2f} ms",
+              file=file)
+
+    if report["counters"]:
+        print("counters:", file=file)
+
+    for name, value in report["counters"].items():
+        if not name.startswith("cache."):
+            print(f"  {name:<40} {value:>12}", file=file)
+
+    if report["cache_hit_rates"]:
+        print("cache hit rates:", file=file)
+
+    for name, record in report["cache_hit_rates"].items():
+        print(f"  {name:<40} {record['rate']:>7.1%} ({record['hits']}/{record['lookups']})",
+              file=file)
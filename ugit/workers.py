@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import functools
+import os
+from typing import Callable
+
+from .repository import Repository
+
+_repository: Repository = None
+
+
+def _init_worker(worktree: str):
+    global _repository
+    _repository = Repository(worktree)
+
+
+def _run_in_worker(function: Callable, batch):
+    return function(_repository, batch)
+
+
+@contextmanager
+def batch_pool(repository: Repository, jobs: int = None):
+    jobs = jobs or os.cpu_count() or 1
+
+    if jobs == 1:
+        yield lambda function, batches: map(functools.partial(function, repository), batches)
+        return
+
+    executor = ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker,
+        initargs=(repository.worktree,))
+
+    try:
+        yield lambda function, batches: executor.map(
+            functools.partial(_run_in_worker, function), batches)
+    finally:
+        executor.shutdown(cancel_futures=True)